@@ -0,0 +1,151 @@
+import argparse
+import itertools
+import json
+import logging
+import numpy as np
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from benchmarks.workloads import WORKLOADS, generate
+from bico.core import BICO
+from bico.kmeans import kmeans_cost, weighted_kmeans
+from typing import Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+PROJECTION_METHODS = ('simple', 'binary', 'binary_tree', 'kdtree')
+
+
+def environment() -> Dict[str, str]:
+    """
+    Describes the benchmarked version and the machine such that results of different runs can be compared
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+    }
+
+
+def run_case(data: np.ndarray, projection_method: str, number_projections: int, coreset_size: int,
+             rebuild_method: str, seed: int, k: int = 0, full_cost: float = None, memory: bool = True) -> dict:
+    """
+    Measures one configuration of BICO on a data set
+    :param data:
+        n x d numpy array
+    :param k:
+        Number of centers for the quality measurement, 0 disables it
+    :param full_cost:
+        Cost of the k-means solution computed on the full data, required if k > 0
+    :param memory:
+        Insert the data a second time while tracing allocations to measure the peak memory
+    :return:
+        Dictionary of measurements
+    """
+    np.random.seed(seed)
+    bico = BICO(data.shape[1], number_projections, coreset_size, projection_method=projection_method,
+                rebuild_method=rebuild_method)
+    tstart = time.perf_counter()
+    bico.insert_batch(data)
+    insert_seconds = time.perf_counter() - tstart
+    tstart = time.perf_counter()
+    coreset = bico.get_coreset()
+    coreset_seconds = time.perf_counter() - tstart
+    result = {
+        'points_per_sec': len(data) / insert_seconds,
+        'insert_seconds': insert_seconds,
+        'rebuilds': len(bico.rebuilds),
+        'rebuild_seconds': sum(rebuild.duration.total_seconds() for rebuild in bico.rebuilds),
+        'get_coreset_seconds': coreset_seconds,
+        'coreset_points': len(coreset),
+        'threshold': bico.thresh,
+    }
+    if memory:
+        np.random.seed(seed)
+        tracemalloc.start()
+        BICO(data.shape[1], number_projections, coreset_size, projection_method=projection_method,
+             rebuild_method=rebuild_method).insert_batch(data)
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if k > 0:
+        centers = weighted_kmeans(coreset[:, 1:], k, coreset[:, 0], seed)
+        result['cost_ratio'] = kmeans_cost(data, centers) / full_cost
+    return result
+
+
+def run(workloads: List[str], dimensions: List[int], n: int, projection_methods: List[str],
+        number_projections: List[int], coreset_size: int, rebuild_method: str = 'reinsert', k: int = 10,
+        repeat: int = 1, seed: int = 0, memory: bool = True) -> Iterator[dict]:
+    """
+    Runs all combinations of workloads, dimensions, projection methods and numbers of projections
+    :return:
+        Iterator over one record per run
+    """
+    for workload, dimension in itertools.product(workloads, dimensions):
+        data = generate(workload, n, dimension, seed)
+        full_cost = kmeans_cost(data, weighted_kmeans(data, k, seed=seed)) if k > 0 else None
+        for method, projections, run_index in itertools.product(projection_methods, number_projections,
+                                                                range(repeat)):
+            logger.info("{} d={} {} projections={} run={}".format(workload, dimension, method, projections,
+                                                                 run_index))
+            record = {
+                'workload': workload,
+                'n': n,
+                'dimension': dimension,
+                'projection_method': method,
+                'number_projections': projections,
+                'coreset_size': coreset_size,
+                'rebuild_method': rebuild_method,
+                'k': k,
+                'run': run_index,
+                'seed': seed + run_index,
+            }
+            record.update(run_case(data, method, projections, coreset_size, rebuild_method, seed + run_index, k,
+                                   full_cost, memory))
+            yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks BICO on synthetic data sets and writes one JSON record '
+                                                 'per run.')
+    parser.add_argument('--workloads', nargs='+', default=sorted(WORKLOADS), choices=sorted(WORKLOADS))
+    parser.add_argument('--dimensions', nargs='+', type=int, default=[2, 8, 32, 128, 512])
+    parser.add_argument('-n', type=int, default=20000, help='number of points (default: %(default)s)')
+    parser.add_argument('--methods', nargs='+', default=list(PROJECTION_METHODS), choices=PROJECTION_METHODS)
+    parser.add_argument('--projections', nargs='+', type=int, default=[5], help='numbers of projections')
+    parser.add_argument('-s', '--coreset-size', type=int, default=1000)
+    parser.add_argument('--rebuild-method', default='reinsert', choices=('reinsert', 'merge'))
+    parser.add_argument('-k', type=int, default=10, help='number of centers for the cost ratio, 0 disables it')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per configuration with consecutive seeds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurement')
+    parser.add_argument('-o', '--output', help='JSON lines output file, standard output by default')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    logging.getLogger('bico').setLevel(logging.WARNING)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        env = environment()
+        for record in run(args.workloads, args.dimensions, args.n, args.methods, args.projections,
+                          args.coreset_size, args.rebuild_method, args.k, args.repeat, args.seed,
+                          not args.no_memory):
+            record.update(env)
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import numpy as np
+from typing import Callable, Dict
+
+
+def blobs(n: int, dimension: int, random_state: np.random.RandomState, k: int = 10) -> np.ndarray:
+    """
+    Gaussian clusters with different spreads around uniformly drawn centers
+    """
+    centers = random_state.uniform(-100, 100, (k, dimension))
+    spreads = random_state.uniform(0.5, 5, k)
+    labels = random_state.randint(k, size=n)
+    return centers[labels] + spreads[labels, np.newaxis] * random_state.standard_normal((n, dimension))
+
+
+def uniform(n: int, dimension: int, random_state: np.random.RandomState) -> np.ndarray:
+    """
+    Points drawn uniformly from a hypercube, i.e. without any cluster structure
+    """
+    return random_state.uniform(-100, 100, (n, dimension))
+
+
+def duplicates(n: int, dimension: int, random_state: np.random.RandomState, distinct: int = 100) -> np.ndarray:
+    """
+    Few distinct points which are repeated many times
+    """
+    points = random_state.uniform(-100, 100, (distinct, dimension))
+    return points[random_state.randint(distinct, size=n)]
+
+
+WORKLOADS = {
+    'blobs': blobs,
+    'uniform': uniform,
+    'duplicates': duplicates,
+}  # type: Dict[str, Callable[[int, int, np.random.RandomState], np.ndarray]]
+
+
+def generate(workload: str, n: int, dimension: int, seed: int) -> np.ndarray:
+    """
+    Generates a synthetic data set
+    :param workload:
+        Name of the workload, one of WORKLOADS
+    :param n:
+        Number of points
+    :param dimension:
+        Dimension of the points
+    :param seed:
+        Seed of the random generator, the same seed yields the same data set
+    :return:
+        n x dimension numpy array
+    """
+    if workload not in WORKLOADS:
+        raise ValueError('Unknown workload {}, expected one of {}'.format(workload, ', '.join(WORKLOADS)))
+    return WORKLOADS[workload](n, dimension, np.random.RandomState(seed))
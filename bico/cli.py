@@ -0,0 +1,238 @@
+import argparse
+import itertools
+import logging
+import numpy as np
+import os
+import sys
+import time
+from bico.core import BICO
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'npy', 'float32', 'float64')
+
+
+def read_csv(file_name: str, chunk_size: int, delimiter: str = ',', skip_rows: int = 0,
+             dtype: np.dtype = np.float64) -> Iterator[np.ndarray]:
+    """
+    Reads a CSV file with one point per row in chunks
+    :param file_name:
+        Path of the CSV file
+    :param chunk_size:
+        Number of rows per chunk
+    :param delimiter:
+        Column delimiter
+    :param skip_rows:
+        Number of header rows to skip
+    :param dtype:
+        Type of the returned arrays
+    :return:
+        Iterator over 2-D numpy arrays with at most chunk_size rows
+    """
+    with open(file_name, 'r', newline='') as f:
+        for _ in range(skip_rows):
+            next(f, None)
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if len(lines) == 0:
+                return
+            yield np.loadtxt(lines, delimiter=delimiter, dtype=dtype, ndmin=2)
+
+
+def read_npy(file_name: str, chunk_size: int, dtype: np.dtype = np.float64) -> Iterator[np.ndarray]:
+    """
+    Reads a 2-D .npy file in chunks through a memory map
+    :param file_name:
+        Path of the .npy file
+    :param chunk_size:
+        Number of rows per chunk
+    :param dtype:
+        Type of the returned arrays
+    :return:
+        Iterator over 2-D numpy arrays with at most chunk_size rows
+    """
+    data = np.load(file_name, mmap_mode='r')
+    if data.ndim != 2:
+        raise ValueError('Expected a 2-D array in {}, got {} dimensions'.format(file_name, data.ndim))
+    return read_array(data, chunk_size, dtype)
+
+
+def read_binary(file_name: str, chunk_size: int, dimension: int, file_dtype: str = 'float64', offset: int = 0,
+                dtype: np.dtype = np.float64) -> Iterator[np.ndarray]:
+    """
+    Reads a raw binary file of row-major floats in chunks through a memory map
+    :param file_name:
+        Path of the binary file
+    :param chunk_size:
+        Number of rows per chunk
+    :param dimension:
+        Number of values per row
+    :param file_dtype:
+        Type of the stored values, float32 or float64
+    :param offset:
+        Number of header bytes to skip
+    :param dtype:
+        Type of the returned arrays
+    :return:
+        Iterator over 2-D numpy arrays with at most chunk_size rows
+    """
+    item_size = np.dtype(file_dtype).itemsize
+    size = os.path.getsize(file_name) - offset
+    if size % (item_size * dimension) != 0:
+        raise ValueError('Size of {} is not a multiple of {} values of type {}'.format(file_name, dimension,
+                                                                                       file_dtype))
+    if size == 0:
+        return iter(())
+    data = np.memmap(file_name, dtype=file_dtype, mode='r', offset=offset,
+                     shape=(size // (item_size * dimension), dimension))
+    return read_array(data, chunk_size, dtype)
+
+
+def read_array(data: np.ndarray, chunk_size: int, dtype: np.dtype = np.float64) -> Iterator[np.ndarray]:
+    """
+    Copies consecutive row blocks of a (memory mapped) array such that only one chunk is resident at a time
+    """
+    for start in range(0, len(data), chunk_size):
+        yield np.array(data[start:start + chunk_size], dtype=dtype)
+
+
+def read_chunks(file_name: str, file_format: str, chunk_size: int, dimension: int = None, delimiter: str = ',',
+                skip_rows: int = 0, dtype: np.dtype = np.float64) -> Iterator[np.ndarray]:
+    """
+    Reads an input file in one of the supported formats in chunks
+    :param file_format:
+        One of csv, npy, float32 or float64 (raw binary)
+    :return:
+        Iterator over 2-D numpy arrays with at most chunk_size rows
+    """
+    if file_format == 'csv':
+        return read_csv(file_name, chunk_size, delimiter, skip_rows, dtype)
+    if file_format == 'npy':
+        return read_npy(file_name, chunk_size, dtype)
+    if file_format in ('float32', 'float64'):
+        if dimension is None:
+            raise ValueError('Raw binary input requires the dimension')
+        return read_binary(file_name, chunk_size, dimension, file_format, dtype=dtype)
+    raise ValueError('Unknown input format {}, expected one of {}'.format(file_format, ', '.join(FORMATS)))
+
+
+def guess_format(file_name: str) -> str:
+    """
+    Derives the input format from the file extension
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == '.npy':
+        return 'npy'
+    if extension in ('.f32', '.float32'):
+        return 'float32'
+    if extension in ('.bin', '.f64', '.float64'):
+        return 'float64'
+    return 'csv'
+
+
+def run(chunks: Iterator[np.ndarray], number_projections: int, coreset_size: int, output: str,
+        report_interval: float = 10.0, **kwargs) -> BICO:
+    """
+    Computes the coreset of a stream of chunks and writes it with BICO.output_coreset
+    :param chunks:
+        Iterator over 2-D numpy arrays with one point per row
+    :param number_projections:
+        Number of projections for faster nearest neighbor search
+    :param coreset_size:
+        Maximum number of points of the reduction result
+    :param output:
+        File name of the coreset
+    :param report_interval:
+        Seconds between two progress reports
+    :param kwargs:
+        Further arguments of the BICO constructor
+    :return:
+        The BICO instance
+    """
+    bico = None
+    rows = 0
+    tstart = time.perf_counter()
+    last_report = tstart
+    for chunk in chunks:
+        if bico is None:
+            bico = BICO(chunk.shape[1], number_projections, coreset_size, **kwargs)
+        bico.insert_batch(chunk)
+        rows += len(chunk)
+        now = time.perf_counter()
+        if now - last_report >= report_interval:
+            logger.info("{} rows, {:.0f} rows/sec, {} clustering features".format(rows, rows / (now - tstart),
+                                                                                 bico.num_cfs))
+            last_report = now
+    if bico is None:
+        raise ValueError('No input data')
+    duration = time.perf_counter() - tstart
+    logger.info("Finished {} rows in {:.2f}s ({:.0f} rows/sec), {} rebuilds, coreset of {} points".format(
+        rows, duration, rows / duration if duration > 0 else float('inf'), len(bico.rebuilds), bico.num_cfs))
+    bico.output_coreset(output)
+    return bico
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bico', description='Computes a BICO coreset of a file with one point per row '
+                                                              'and saves it as .npy file with the weights in the first '
+                                                              'column.')
+    parser.add_argument('input', help='input file')
+    parser.add_argument('-o', '--output', default='coreset.npy', help='output file (default: %(default)s)')
+    parser.add_argument('-s', '--coreset-size', type=int, required=True, help='maximum number of coreset points')
+    parser.add_argument('-p', '--projections', type=int, default=5,
+                        help='number of projections for the nearest neighbor search (default: %(default)s)')
+    parser.add_argument('-f', '--format', choices=FORMATS,
+                        help='input format, derived from the file extension by default (.npy, .f32, .f64/.bin, csv '
+                             'otherwise)')
+    parser.add_argument('-d', '--dimension', type=int, help='number of values per row, required for raw binaries')
+    parser.add_argument('-c', '--chunk-size', type=int, default=65536,
+                        help='number of rows read at once (default: %(default)s)')
+    parser.add_argument('--delimiter', default=',', help='CSV delimiter (default: %(default)s)')
+    parser.add_argument('--skip-rows', type=int, default=0, help='number of CSV header rows')
+    parser.add_argument('--projection-method', default='simple', choices=('simple', 'binary', 'binary_tree', 'kdtree'),
+                        help='nearest neighbor structure (default: %(default)s)')
+    parser.add_argument('--dtype', default='float64', choices=('float32', 'float64'),
+                        help='precision of the points and of the coreset (default: %(default)s)')
+    parser.add_argument('--rebuild-method', default='reinsert', choices=('reinsert', 'merge'),
+                        help='how the tree is rebuilt when the threshold grows (default: %(default)s)')
+    parser.add_argument('--index-cutoff', type=int, default=16,
+                        help='number of children up to which a node scans them instead of indexing them '
+                             '(default: %(default)s)')
+    parser.add_argument('--duplicate-cache', type=int, default=0,
+                        help='collapse repeated points of a chunk into weighted insertions and cache up to this many '
+                             'points (default: disabled)')
+    parser.add_argument('--quantization', type=float,
+                        help='with --duplicate-cache, treat points in the same grid cell of this width as repeats')
+    parser.add_argument('--memory-budget', type=int,
+                        help='maximum number of bytes of the tree, rebuilt with a larger threshold beyond it')
+    parser.add_argument('--threshold-policy', default='double', choices=('double', 'target_fill'),
+                        help='how the threshold grows when the tree is full (default: %(default)s)')
+    parser.add_argument('--reduce-dim', type=int,
+                        help='reduce the points to this dimension by a random projection before they are inserted')
+    parser.add_argument('--full-sums', action='store_true',
+                        help='with --reduce-dim, return the coreset in the original dimension')
+    parser.add_argument('--report-interval', type=float, default=10.0,
+                        help='seconds between two progress reports (default: %(default)s)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only report errors')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR if args.quiet else logging.INFO, format='%(asctime)s %(message)s')
+    # the tree logs every rebuild on the info level
+    logging.getLogger('bico.core').setLevel(logging.WARNING)
+    try:
+        chunks = read_chunks(args.input, args.format or guess_format(args.input), args.chunk_size, args.dimension,
+                             args.delimiter, args.skip_rows, np.dtype(args.dtype))
+        run(chunks, args.projections, args.coreset_size, args.output, args.report_interval,
+            projection_method=args.projection_method, rebuild_method=args.rebuild_method, dtype=np.dtype(args.dtype),
+            reduce_dim=args.reduce_dim, full_sums=args.full_sums, threshold_policy=args.threshold_policy,
+            index_cutoff=args.index_cutoff, duplicate_cache=args.duplicate_cache, quantization=args.quantization,
+            memory_budget_bytes=args.memory_budget)
+    except (OSError, ValueError) as e:
+        logger.error(str(e))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
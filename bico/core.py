@@ -1,25 +1,67 @@
 from collections import deque
-from math import sqrt
+from math import floor, log2, sqrt
 
+import attr
+import heapq
 import logging
 import numpy as np
+import os
+import sys
+import threading
+import tracemalloc
+from bico.geometry.closest_pair import closest_pair_distance
 from bico.geometry.point import Point
+from bico.kmeans import predict, weighted_kmeans
 from bico.nearest_neighbor.base import NearestNeighbor
-from bico.nearest_neighbor.random_binary_projections import RandomBinaryNN
-from bico.nearest_neighbor.random_binary_tree import RandomBinaryTreeNN
-from bico.nearest_neighbor.simple_projection import SimpleProjection
+from bico.nearest_neighbor.registry import get_engine
+from bico.reduction import random_projection
+from bico.threshold import get_policy
 from bico.utils.BICONode import BICONode
-from bico.utils.ClusteringFeature import ClusteringFeature
-from datetime import datetime
+from bico.utils.ClusteringFeatureStorage import ClusteringFeatureStorage
+from bico.utils.DuplicateCache import DuplicateCache
+from bico.utils.Statistics import LevelStatistics
+from datetime import timedelta
+from time import perf_counter_ns, sleep
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 
+def is_sparse(points: Any) -> bool:
+    """
+    Checks whether points are given as scipy.sparse matrix. scipy.sparse is not imported for this check since it is only
+    loaded if sparse input is actually used.
+    """
+    sparse = sys.modules.get('scipy.sparse')
+    return sparse is not None and sparse.issparse(points)
+
+
+@attr.s
+class RebuildStatistics:
+    method = attr.ib(type=str)
+    threshold = attr.ib(type=float)
+    num_cfs_before = attr.ib(type=int)
+    num_cfs_after = attr.ib(type=int)
+    duration = attr.ib(type=timedelta)
+    # bytes allocated at the peak of the rebuild, only traced if trace_memory is activated
+    peak_memory = attr.ib(type=Optional[int], default=None)
+    # factor the threshold was raised by and number of whole doublings this rebuild replaced beyond the first one
+    factor = attr.ib(type=float, default=2.0)
+    rebuilds_avoided = attr.ib(type=int, default=0)
+    # 'coreset_size' or 'memory_budget', the limit which was exceeded, 'merge' if the threshold of a merged instance
+    # was adopted
+    reason = attr.ib(type=str, default='coreset_size')
+
+
 class BICO:
     """ Base class for bico applications """
 
     def __init__(self, dimension: int, number_projections: int, coreset_size: int,
-                 projection_method='simple', verbose=False, track_time=False):
+                 projection_method='simple', verbose=False, track_time=False, rebuild_method='reinsert',
+                 collect_stats=False, dtype=np.float64, sparse=False, densify_ratio=0.1, reduce_dim=None,
+                 reduce_method='gaussian', reduce_seed=0, full_sums=False, threshold_policy='double',
+                 index_cutoff=16, duplicate_cache=0, quantization=None, memory_budget_bytes=None,
+                 trace_memory=False):
         """
         :param dimension:
             Dimension of input points
@@ -33,85 +75,589 @@ class BICO:
             - 'simple': Simple random projection technique (default)
             - 'binary': Random binary projection technique implement by nearpy package
             - 'binary_tree': Random binary tree technique implement by nearpy package
+            - 'kdtree': Exact radius search with a scipy kd-tree, best for low dimensions
+            Further implementations can be added with bico.nearest_neighbor.registry.register_engine. The nearpy based
+            methods require the optional nearpy package.
         :param track_time:
-            activate tracking of nearest neighbor time consumption on each level of the BICO tree
+            activate statistics like collect_stats
         :param verbose:
             activate debug logging
+        :param rebuild_method:
+            Method to reduce the number of clustering features after the threshold has been doubled:
+            - 'reinsert': All clustering features are reinserted into a new tree (default)
+            - 'merge': The tree is kept and leaves are merged bottom-up into their parents and siblings
+        :param collect_stats:
+            activate counters and nearest neighbor timers on each level of the BICO tree, see stats
+        :param dtype:
+            Floating point type of the input points, reference points, projections and of the coreset, e.g. np.float32
+            to halve memory and bandwidth. Sums, squared sums and costs are accumulated in float64 regardless.
+        :param sparse:
+            Keep points, reference points and sums as scipy.sparse CSR rows for high-dimensional sparse input. Batches
+            are converted to CSR, projections and inner products are computed sparsely and the coreset is returned as
+            CSR matrix. Requires the 'simple' projection method, which is replaced by its sparse variant.
+        :param densify_ratio:
+            Fraction of nonzero entries above which the sum of a clustering feature is stored as dense array in sparse
+            mode
+        :param reduce_dim:
+            Reduce the points to this dimension by a Johnson-Lindenstrauss random projection before they are inserted,
+            see bico.reduction.random_projection for the preserved accuracy. Projections, distances and cost tests are
+            then computed in the reduced dimension. The coreset is returned in the reduced dimension unless full_sums
+            is set.
+        :param reduce_method:
+            Random projection for reduce_dim, 'gaussian' (default) or 'achlioptas'
+        :param reduce_seed:
+            Seed of the random projection for reduce_dim. Instances with the same seed reduce points identically, so
+            their coresets and trees can be merged.
+        :param full_sums:
+            Additionally sum up the original coordinates of the points in each clustering feature such that the
+            coreset is returned in the original dimension. Costs still only depend on the reduced coordinates.
+        :param threshold_policy:
+            How the threshold is raised when there are too many clustering features, a name or a
+            bico.threshold.ThresholdPolicy:
+            - 'double': The threshold is doubled (default)
+            - 'target_fill': The threshold is raised by the factor which is expected to leave 70% of coreset_size
+              clustering features, up to a factor of 8, see bico.threshold.TargetFillPolicy
+        :param index_cutoff:
+            Number of children up to which the nearest neighbor structure of a node scans all children by brute force
+            instead of maintaining its index. The index is built once a node exceeds it. Only the simple and sparse
+            projection methods support scanning, and both give the same results either way.
+        :param duplicate_cache:
+            Number of point keys mapped to the clustering feature which absorbed the point last, 0 to disable. A point
+            inserted by insert_point whose key is cached is added to that clustering feature in place if the cost test
+            passes, without descending the tree. Rows of a batch with equal keys are collapsed into one weighted
+            clustering feature before insertion. The cache is cleared by every rebuild. Not supported in sparse mode.
+        :param quantization:
+            Grid width of the keys of duplicate_cache such that all points of a grid cell share a key, e.g. the
+            resolution of quantized sensor readings. Keys are the exact bytes of the points if omitted.
+        :param memory_budget_bytes:
+            Maximum number of bytes of clustering features, nearest neighbor structures and nodes as reported by
+            memory_usage. The tree is rebuilt with a raised threshold whenever it exceeds the budget, in addition to the
+            limit of coreset_size. The usage is checked after batches and whenever the number of clustering features
+            has grown by 1/16 since the last check, so it may exceed the budget in between.
+        :param trace_memory:
+            Trace the peak memory of each rebuild with tracemalloc. Tracing slows down every allocation, so the
+            recorded durations of rebuilds are only comparable between instances without it.
         """
         self.dimension = dimension
+        self.dtype = np.dtype(dtype)
         self.number_projections = number_projections
-        self.projection_func = projection_method
+        self.projection_method = projection_method
         self.coreset_size = coreset_size
         self.thresh = 1
         self.num_cfs = 0
         self.buffer_phase = True
         self.buffer = []
-        self.time = []
         self.track_time = track_time
+        self.collect_stats = collect_stats or track_time
+        self.trace_memory = trace_memory
+        self.level_statistics = []
+        self.threshold_history = []
+        self.callbacks = {'rebuild': [], 'buffer_phase_finished': []}
         self.verbose = verbose
+        self.storages = []
+        self.projections = []
+        self.rebuilds = []
+        # incremented by every modification, snapshots are only recomputed if it changed
+        self.version = 0
+        self.__snapshot = None
+        # odd while a rebuild replaces the tree, snapshot does not read the tree in the meantime
+        self.__rebuild_sequence = 0
+        # centers of the last call of fit_kmeans
+        self.centers = None
+        if rebuild_method not in ('reinsert', 'merge'):
+            raise ValueError('Unknown rebuild method: {}'.format(rebuild_method))
+        self.rebuild_method = rebuild_method
+        self.threshold_policy = get_policy(threshold_policy)
+        self.index_cutoff = index_cutoff
+        # insert_batch of a node inserts the pending rows one by one once fewer than one in this many rows resolve to an
+        # existing child per batch lookup; ratios from 1 up to never falling back perform alike, always falling back
+        # is up to 45% slower with the kdtree engine
+        self.batch_fallback_ratio = 16
+        if duplicate_cache > 0 and sparse:
+            raise ValueError('The duplicate cache is not supported in sparse mode')
+        self.duplicate_cache = DuplicateCache(duplicate_cache, quantization) if duplicate_cache > 0 else None
+        # node whose clustering feature absorbed or opened the last insertion, recorded by BICONode
+        self.absorbing_node = None
+        self.memory_budget_bytes = memory_budget_bytes
+        # number of clustering features at which the memory usage is checked next
+        self.next_memory_check = 0
+        self.sparse = sparse
+        self.densify_ratio = densify_ratio
+        if sparse:
+            if projection_method not in ('simple', 'sparse'):
+                raise ValueError('Sparse input requires the simple projection method, got {}'.format(projection_method))
+            projection_method = 'sparse'
+        if reduce_dim is not None and sparse:
+            raise ValueError('Reduced points are dense, reduce_dim cannot be combined with sparse mode')
+        self.reduce_dim = reduce_dim
+        self.reduce_method = reduce_method
+        self.reduce_seed = reduce_seed
+        self.full_sums = full_sums and reduce_dim is not None
+        self.reduction = None
+        # dimension of the reference points of the tree and of the returned coreset
+        self.tree_dimension = dimension
+        self.output_dimension = dimension
+        if reduce_dim is not None:
+            self.reduction = random_projection(dimension, reduce_dim, reduce_method, reduce_seed, self.dtype)
+            self.tree_dimension = reduce_dim
+            self.output_dimension = dimension if self.full_sums else reduce_dim
+
+        # the implementation is called with (dimension, number projections, radius, projections); importing it here
+        # reports a missing optional dependency before any point is inserted
+        self.projection_func = get_engine(projection_method)
 
-        name = 'create_{}_projection'.format(projection_method.lower())
-        self.projection_func = getattr(BICO, name, None)
-        if self.projection_func is None:
-            raise ValueError('Unknown projection method: {}'.format(projection_method))
+        self.root = BICONode(0, self.tree_dimension, number_projections, self, projection_func=self.projection_func)
 
-        self.root = BICONode(0, dimension, number_projections, self, projection_func=self.projection_func)
+    @staticmethod
+    def create_simple_projection(dim: int, proj: int, thresh: float,
+                                 projections: np.ndarray = None) -> NearestNeighbor:
+        return get_engine('simple')(dim, proj, thresh, projections)
 
     @staticmethod
-    def create_simple_projection(dim: int, proj: int, thresh: float) -> NearestNeighbor:
-        return SimpleProjection(dim, proj, thresh)
+    def create_binary_projection(dim: int, proj: int, thresh: float,
+                                 projections: np.ndarray = None) -> NearestNeighbor:
+        return get_engine('binary')(dim, proj, thresh, projections)
 
     @staticmethod
-    def create_binary_projection(dim: int, proj: int, thresh: float) -> NearestNeighbor:
-        return RandomBinaryNN(dim, proj, thresh)
+    def create_binary_tree_projection(dim: int, proj: int, thresh: float,
+                                      projections: np.ndarray = None) -> NearestNeighbor:
+        return get_engine('binary_tree')(dim, proj, thresh, projections)
 
     @staticmethod
-    def create_binary_tree_projection(dim: int, proj: int, thresh: float) -> NearestNeighbor:
-        return RandomBinaryTreeNN(dim, proj, thresh)
+    def create_kdtree_projection(dim: int, proj: int, thresh: float,
+                                 projections: np.ndarray = None) -> NearestNeighbor:
+        return get_engine('kdtree')(dim, proj, thresh, projections)
 
     def insert_point(self, point: Point):
         """
         Insert a single geometry into the data structure.
         :param point:
-            Point to be inserted
+            Point to be inserted, in sparse mode its coordinates may be a CSR row or a 1-D numpy array
         :return:
             None
         """
         if self.verbose:
-            logger.debug("Insert point: {}".format(point))
+            logger.debug("Insert point: %s", point)
+        if self.sparse:
+            point = Point(self.as_points(point.p))
         if self.buffer_phase:
             self.buffer.append(point)
+            self.version += 1
             if len(self.buffer) > sqrt(self.coreset_size):
-                logger.info("Buffer phase finished.")
-                self.buffer_phase = False
-                minDist = -1
-                for p in self.buffer:
-                    for p2 in self.buffer:
-                        d = p.p - p2.p
-                        dist = np.ma.inner(d, d)
-                        if dist == 0:
-                            continue
-                        if minDist == -1 or minDist > dist:
-                            minDist = dist
-                if self.verbose:
-                    logger.debug("Initial Threshold: " + str(16 * minDist))
-                self.thresh = 16 * minDist
-                for p in self.buffer:
-                    self.insert_point(p)
+                self.finish_buffer_phase()
+        elif self.reduction is not None or self.sparse:
+            # reduced and sparse points are inserted as batch of one row
+            self.insert_batch(point.p)
         else:
-            point_cf = ClusteringFeature(point, point, point * point, 1)
-            self.num_cfs += self.root.insert_point(point_cf)
+            cache = self.duplicate_cache
+            if cache is not None:
+                key = cache.key(point.p)
+                node = cache.get(key)
+                if node is not None and node.absorb(point.p, point.p, point * point, 1):
+                    self.version += 1
+                    return
+            self.num_cfs += self.root.insert(point.p, point.p, point * point, 1)
+            self.version += 1
+            if cache is not None:
+                cache.put(key, self.absorbing_node)
             if self.num_cfs > self.coreset_size:
-                # rebuild
-                tstart = datetime.now()
+                self.rebuild()
+            self.check_memory_budget()
+
+    def finish_buffer_phase(self, references: np.ndarray = None):
+        """
+        Ends the buffer phase: the initial threshold is derived from the closest pair of distinct buffered points and
+        all buffered points are inserted into the tree.
+        :param references:
+            Optional reference points of clustering features which are inserted next and take part in the closest
+            pair computation
+        :return:
+            None
+        """
+        logger.info("Buffer phase finished.")
+        self.buffer_phase = False
+        buffer = self.get_buffer()
+        # the threshold refers to the reduced points which are compared in the tree
+        reduced = self.reduce(buffer)
+        minDist = closest_pair_distance(reduced if references is None else self.stack([reduced, references]))
+        if minDist > 0:
+            # otherwise all buffered points coincide and any positive threshold keeps them in one clustering feature
+            self.thresh = 16 * minDist
+        if self.verbose:
+            logger.debug("Initial Threshold: %s", self.thresh)
+        self.threshold_history.append(self.thresh)
+        self.insert_batch(buffer)
+        self.notify('buffer_phase_finished')
+
+    def insert_batch(self, points: np.ndarray, chunk_size: int = 4096):
+        """
+        Insert a batch of points into the data structure. Projections, nearest neighbor lookups and cost tests are
+        computed for whole chunks of points at once which is much faster than calling insert_point for every row, 2 to 3
+        times for 20k clustered points and 4 to 10 times for 100k. The order of the rows is relaxed: rows close to an
+        existing node are routed to it before an earlier row of the chunk opens a new node, so the tree can differ from
+        the one built by insert_point. Deep levels receive only a few rows per call and rebuilds take as long as with
+        insert_point, which limits the speedup for small inputs.
+        :param points:
+            2-D numpy array or scipy.sparse matrix with one point per row. Sparse batches are densified unless sparse
+            mode is active.
+        :param chunk_size:
+            Number of points inserted between two checks whether the tree has to be rebuilt
+        :return:
+            None
+        """
+        points = self.as_points(points)
+        if points.shape[1] != self.dimension:
+            raise ValueError('Expected points of dimension {}, got {}'.format(self.dimension, points.shape[1]))
+        start = 0
+        if self.buffer_phase:
+            start = int(sqrt(self.coreset_size)) + 1 - len(self.buffer)
+            self.buffer.extend(Point(row) for row in points[:start].copy())
+            self.version += 1
+            if len(self.buffer) > sqrt(self.coreset_size):
+                self.finish_buffer_phase()
+        points = points[start:]
+        if self.duplicate_cache is not None:
+            self.insert_clustering_features(*self.collapse_duplicates(points), chunk_size)
+            return
+        refs, sums = self.get_features(points)
+        self.insert_clustering_features(refs, sums, self.squared_norms(refs), np.ones(points.shape[0], dtype=int),
+                                        chunk_size)
+
+    def collapse_duplicates(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Collapses the rows of a batch of points with equal keys of the duplicate cache into weighted clustering
+        features. The first row of each group is its reference point and groups keep the order of their first rows.
+        :return:
+            refs, sums, squared sums and sizes of the clustering features
+        """
+        refs, sums = self.get_features(points)
+        squared = self.squared_norms(refs)
+        _, first, inverse, counts = np.unique(self.duplicate_cache.keys(points), axis=0, return_index=True,
+                                              return_inverse=True, return_counts=True)
+        if len(first) == points.shape[0]:
+            return refs, sums, squared, np.ones(points.shape[0], dtype=int)
+        self.duplicate_cache.collapsed += points.shape[0] - len(first)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        # rows sorted by group, each group in insertion order
+        rows = np.argsort(rank[np.ravel(inverse)], kind='stable')
+        counts = counts[order]
+        starts = np.cumsum(counts) - counts
+        return refs[first[order]], np.add.reduceat(sums[rows], starts, dtype=np.float64), \
+            np.add.reduceat(squared[rows], starts), counts
+
+    def reduce(self, points: np.ndarray) -> np.ndarray:
+        """
+        Applies the dimensionality reduction of reduce_dim to a batch of points, points are returned as they are if the
+        dimension is not reduced
+        """
+        if self.reduction is None:
+            return points
+        return points.dot(self.reduction.T)
+
+    def get_features(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the reference points and the sums of the clustering features of a batch of single points. Both are the
+        points themselves unless the dimension is reduced.
+        """
+        refs = self.reduce(points)
+        if self.full_sums:
+            return refs, np.hstack([refs, points])
+        return refs, refs
+
+    def as_points(self, points: Any) -> np.ndarray:
+        """
+        Converts a batch of points to the representation of this instance: a 2-D numpy array of its dtype or, in sparse
+        mode, a CSR matrix
+        """
+        if self.sparse:
+            from scipy.sparse import csr_matrix
+            points = csr_matrix(points if is_sparse(points) else np.array(points, ndmin=2, copy=None), dtype=self.dtype)
+            # sorted column indices without duplicates are assumed by the inner products of the sparse storage
+            points.sum_duplicates()
+            return points
+        if is_sparse(points):
+            points = points.toarray()
+        return np.array(points, dtype=self.dtype, ndmin=2, copy=None)
+
+    def squared_norms(self, points: np.ndarray) -> np.ndarray:
+        """
+        Returns the squared norm of every row of a batch of points in float64
+        """
+        if self.sparse:
+            from bico.utils.SparseClusteringFeatureStorage import squared_norms
+            return squared_norms(points)
+        return np.einsum('ij,ij->i', points, points, dtype=np.float64)
+
+    def stack(self, blocks: List[np.ndarray]) -> np.ndarray:
+        """
+        Concatenates batches of points in the representation of this instance
+        """
+        if self.sparse:
+            from scipy.sparse import vstack
+            return vstack(blocks, format='csr', dtype=self.dtype)
+        return np.vstack(blocks)
+
+    def get_buffer(self) -> np.ndarray:
+        """
+        Returns the points of the buffer phase as one batch in the representation of this instance
+        """
+        if self.sparse:
+            from scipy.sparse import csr_matrix
+            return self.stack([csr_matrix((0, self.dimension))] + [p.p for p in self.buffer])
+        return np.array([p.p for p in self.buffer], dtype=self.dtype).reshape(-1, self.dimension)
+
+    def insert_coreset(self, coreset: np.ndarray, chunk_size: int = 4096):
+        """
+        Insert a weighted point set like the result of get_coreset of another BICO instance into the data structure.
+        :param coreset:
+            (size) x (dim+1) dimensional numpy array with the weight of each point in the first column, a scipy.sparse
+            matrix in sparse mode
+        :param chunk_size:
+            Number of points inserted between two checks whether the tree has to be rebuilt
+        :return:
+            None
+        """
+        if self.sparse:
+            from scipy.sparse import csr_matrix
+            coreset = csr_matrix(coreset, dtype=float)
+        else:
+            coreset = np.array(coreset, dtype=float, ndmin=2)
+        if coreset.shape[1] != self.dimension + 1:
+            raise ValueError('Expected weighted points of dimension {}, got {}'.format(self.dimension,
+                                                                                     coreset.shape[1] - 1))
+        if self.sparse:
+            from scipy.sparse import diags
+            weights = np.ravel(coreset[:, 0].toarray())
+            refs, sums = self.as_points(coreset[:, 1:]), diags(weights).dot(coreset[:, 1:]).tocsr()
+        else:
+            weights = coreset[:, 0]
+            refs, sums = self.get_features(self.as_points(coreset[:, 1:]))
+            sums = weights[:, np.newaxis] * sums
+        self.insert_clustering_features(refs, sums, weights * self.squared_norms(refs), weights, chunk_size)
+
+    def insert_clustering_features(self, refs: np.ndarray, sums: np.ndarray, squared: np.ndarray, sizes: np.ndarray,
+                                   chunk_size: int = 4096):
+        """
+        Insert a batch of clustering features into the data structure. A pending buffer phase is finished first.
+        :param refs:
+            Reference points of the clustering features, one per row
+        :param sums:
+            Sums of the clustering features, one per row
+        :param squared:
+            Squared sums of the clustering features
+        :param sizes:
+            Sizes of the clustering features
+        :param chunk_size:
+            Number of clustering features inserted between two checks whether the tree has to be rebuilt
+        :return:
+            None
+        """
+        if len(sizes) == 0:
+            return
+        if self.buffer_phase:
+            self.finish_buffer_phase(refs)
+        for start in range(0, len(sizes), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            self.num_cfs += self.root.insert_batch(refs[chunk], sums[chunk], squared[chunk], sizes[chunk])
+            self.version += 1
+            while self.num_cfs > self.coreset_size:
+                num_cfs = self.num_cfs
+                self.rebuild()
+                if self.num_cfs >= num_cfs or not np.isfinite(self.thresh):
+                    # like insert_point, retry after further insertions if raising the threshold did not help
+                    break
+            self.check_memory_budget()
+
+    def shrink(self):
+        """
+        Rebuilds the tree with raised thresholds until it holds at most coreset_size clustering features. Insertions
+        give up after a rebuild which does not shrink the tree and retry after further points, so this has to be called
+        once no further points follow, e.g. after merging coresets.
+        :return:
+            None
+        """
+        while self.num_cfs > self.coreset_size and np.isfinite(self.thresh):
+            self.rebuild()
+        if self.num_cfs > self.coreset_size:
+            logger.warning("%s clustering features exceed the coreset size of %s", self.num_cfs, self.coreset_size)
+
+    def check_memory_budget(self):
+        """
+        Rebuilds the tree with raised thresholds until its memory usage fits into memory_budget_bytes. The usage is only
+        determined if the number of clustering features has reached the next check, which is set such that the
+        traversals of memory_usage take amortized constant time per clustering feature.
+        :return:
+            None
+        """
+        if self.memory_budget_bytes is None or self.num_cfs < self.next_memory_check:
+            return
+        while self.memory_usage()['total'] > self.memory_budget_bytes:
+            num_cfs = self.num_cfs
+            self.rebuild(reason='memory_budget')
+            if self.num_cfs >= num_cfs:
+                # preallocated rows and the projections do not shrink with the number of clustering features
+                logger.warning("Memory budget of %s bytes cannot be met by rebuilds", self.memory_budget_bytes)
+                break
+        self.next_memory_check = self.num_cfs + max(16, self.num_cfs // 16)
+
+    def decay(self, factor: float):
+        """
+        Down-weights the data seen so far, e.g. periodically to obtain an exponentially time-decayed coreset of an
+        unbounded stream. Sizes, sums and squared sums of all clustering features are multiplied by the factor, so
+        centers are kept while weights fade. The threshold is scaled by the same factor such that the tree stays valid
+        for the decayed weights and new points are summarized as finely as before. Points of a pending buffer phase
+        are not affected.
+        :param factor:
+            Decay factor in (0, 1]
+        :return:
+            None
+        """
+        if not 0 < factor <= 1:
+            raise ValueError('Decay factor must be in (0, 1], got {}'.format(factor))
+        if self.buffer_phase:
+            return
+        for storage in self.storages:
+            storage.scale(factor)
+        self.thresh *= factor
+        self.threshold_history.append(self.thresh)
+        for node in self.root.iter_nodes():
+            if node.nn_engine is not None and not node.nn_engine.set_threshold(self.get_radius(node.level)):
+                # rebuilt on the next lookup
+                node.nn_engine = None
+        self.version += 1
+
+    def merge(self, other: 'BICO'):
+        """
+        Merges the clustering features of another BICO instance of the same dimension into this one. The threshold of
+        this instance is raised to the threshold of the other instance if necessary.
+        :param other:
+            BICO instance, e.g. built on another part of the data in a separate process
+        :return:
+            None
+        """
+        if other.dimension != self.dimension:
+            raise ValueError('Expected BICO of dimension {}, got {}'.format(self.dimension, other.dimension))
+        if other.full_sums != self.full_sums or not np.array_equal(other.reduction, self.reduction):
+            raise ValueError('Cannot merge BICO instances with different dimensionality reductions')
+        if other.buffer_phase:
+            self.insert_batch(other.get_buffer())
+            return
+        if self.buffer_phase:
+            self.buffer_phase = False
+            self.thresh = other.thresh
+            self.threshold_history.append(self.thresh)
+            self.insert_batch(self.get_buffer())
+            self.notify('buffer_phase_finished')
+        elif other.thresh > self.thresh:
+            self.rebuild(other.thresh, reason='merge')
+        for refs, sums, squared, sizes in other.get_clustering_features():
+            self.insert_clustering_features(refs, sums, squared, sizes)
+        self.shrink()
+
+    @classmethod
+    def from_coreset(cls, coreset: np.ndarray, number_projections: int, coreset_size: int, **kwargs) -> 'BICO':
+        """
+        Creates a BICO instance from a weighted point set like the result of get_coreset.
+        :param coreset:
+            (size) x (dim+1) dimensional numpy array with the weight of each point in the first column
+        :param number_projections:
+            Number of projections for faster nearest neighbor search
+        :param coreset_size:
+            Maximum number of points of the reduction result
+        :param kwargs:
+            Further arguments of the BICO constructor
+        :return:
+            BICO instance containing the weighted points
+        """
+        if kwargs.get('reduce_dim') is not None and not kwargs.get('full_sums', False):
+            # the coreset has already been reduced
+            kwargs = dict(kwargs, reduce_dim=None)
+        bico = cls(np.shape(coreset)[1] - 1, number_projections, coreset_size, **kwargs)
+        bico.insert_coreset(coreset)
+        bico.shrink()
+        return bico
+
+    def insert_batches(self, chunks: Iterable[np.ndarray], chunk_size: int = 4096):
+        """
+        Insert a stream of point batches into the data structure.
+        :param chunks:
+            Iterable of 2-D numpy arrays with one point per row
+        :param chunk_size:
+            Number of points inserted between two checks whether the tree has to be rebuilt
+        :return:
+            None
+        """
+        for chunk in chunks:
+            self.insert_batch(chunk, chunk_size)
+
+    def rebuild(self, threshold: float = None, reason: str = 'coreset_size'):
+        """
+        Raises the threshold according to the threshold policy and reduces the number of clustering features according
+        to the rebuild method. Duration and, if trace_memory is activated, peak memory of each rebuild are recorded in
+        self.rebuilds.
+        :param threshold:
+            Optional new threshold to use instead of the one chosen by the threshold policy
+        :param reason:
+            Limit which triggered the rebuild, recorded in its RebuildStatistics
+        :return:
+            None
+        """
+        trace_memory = self.trace_memory and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+        tstart = perf_counter_ns()
+        num_cfs = self.num_cfs
+        if self.duplicate_cache is not None:
+            # the cached nodes belong to the old tree
+            self.duplicate_cache.clear()
+        previous = self.thresh
+        self.thresh = self.threshold_policy.next_threshold(self) if threshold is None else threshold
+        factor = self.thresh / previous
+        # doubling would have needed one rebuild per doubling to reach the same threshold, only whole doublings count
+        avoided = max(0, floor(log2(factor) + 1e-9) - 1) if threshold is None and 1 <= factor < np.inf else 0
+        self.threshold_history.append(self.thresh)
+        self.__rebuild_sequence += 1
+        try:
+            if self.rebuild_method == 'merge':
+                self.merge_tree()
+            else:
                 queue = deque()
                 for node in self.root.point_to_biconode:
                     queue.append(node)
                 self.num_cfs = 0
-                self.thresh *= 2.0
                 self.rebuild_tree(queue)
-                tend = datetime.now()
-                logger.info("Rebuild time: {}".format(tend - tstart))
+        finally:
+            self.version += 1
+            self.__rebuild_sequence += 1
+        duration = timedelta(microseconds=(perf_counter_ns() - tstart) / 1000)
+        peak_memory = None
+        if trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        statistics = RebuildStatistics(self.rebuild_method, self.thresh, num_cfs, self.num_cfs, duration, peak_memory,
+                                       factor, avoided, reason)
+        self.rebuilds.append(statistics)
+        logger.info("Rebuild time: %s", duration)
+        self.notify('rebuild', statistics)
+
+    def merge_tree(self):
+        """
+        Rebuilds the BICO tree in place after the threshold has been raised. Inner nodes are processed bottom-up: the
+        leaves of each node are merged into its clustering feature or into close siblings while the node objects,
+        the storage rows and the nearest neighbor structures of inner nodes are reused.
+        :return:
+            None
+        """
+        logger.info(
+            "Created too many coreset points. Start merging with new threshold: %s", self.thresh)
+        levels = [[self.root]]
+        while len(levels[-1]) > 0:
+            levels.append([child for node in levels[-1] for child in node.point_to_biconode if child.num_cfs > 0])
+        for nodes in reversed(levels):
+            for node in nodes:
+                self.num_cfs += node.merge_children()
 
     def rebuild_tree(self, queue: deque):
         """
@@ -122,14 +668,187 @@ class BICO:
         :return:
             None
         """
-        self.root = BICONode(0, self.dimension, self.number_projections, self, self.projection_func)
+        levels = self.collect_clustering_features(queue)
+        self.storages = []
+        self.root = BICONode(0, self.tree_dimension, self.number_projections, self, self.projection_func)
         logger.info(
-            "Created too many coreset points. Start rebuilding with new threshold: {}".format(self.thresh))
+            "Created too many coreset points. Start rebuilding with new threshold: %s", self.thresh)
+        for refs, sums, squared, sizes in levels:
+            self.num_cfs += self.root.insert_batch(refs, sums, squared, sizes)
+
+    @staticmethod
+    def collect_clustering_features(queue: deque) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Collects the clustering features of the subtrees of all nodes in the queue level by level such that parents
+        precede their children.
+        :param queue:
+            Queue of BICO nodes, consumed by this method
+        :return:
+            List of (refs, sums, squared, sizes) arrays
+        """
+        levels = []
         while len(queue) > 0:
-            node1 = queue.pop()
-            for node2 in node1.point_to_biconode:
-                queue.append(node2)
-            self.num_cfs += self.root.insert_point(node1.cf)
+            nodes = list(queue)
+            queue.clear()
+            for node in nodes:
+                queue.extend(node.point_to_biconode)
+            rows = {}
+            for node in nodes:
+                rows.setdefault(id(node.storage), (node.storage, []))[1].append(node.index)
+            for storage, index in rows.values():
+                levels.append((storage.refs[index], storage.sums[index], storage.squared[index],
+                               storage.sizes[index]))
+        return levels
+
+    def get_clustering_features(self) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Returns all clustering features of the tree level by level as (refs, sums, squared, sizes) arrays.
+        """
+        return self.collect_clustering_features(deque(self.root.point_to_biconode))
+
+    def get_projections(self, level: int) -> np.ndarray:
+        """
+        Returns the random projection matrix shared by the nearest neighbor structures of all nodes of a specified level
+        of the internal tree data structure.
+        """
+        while len(self.projections) <= level:
+            self.projections.append(np.random.standard_normal((self.number_projections, self.tree_dimension))
+                                    .astype(self.dtype))
+        return self.projections[level]
+
+    def get_storage(self, level: int) -> ClusteringFeatureStorage:
+        """
+        Returns the storage of the clustering features of a specified level of the internal tree data structure.
+        """
+        while len(self.storages) <= level:
+            if self.sparse:
+                # imported here such that scipy.sparse is only loaded for sparse input
+                from bico.utils.SparseClusteringFeatureStorage import SparseClusteringFeatureStorage
+                self.storages.append(SparseClusteringFeatureStorage(self.dimension, dtype=self.dtype,
+                                                                    densify_ratio=self.densify_ratio))
+            else:
+                sum_dimension = self.tree_dimension + self.dimension if self.full_sums else None
+                self.storages.append(ClusteringFeatureStorage(self.tree_dimension, dtype=self.dtype,
+                                                              sum_dimension=sum_dimension))
+        return self.storages[level]
+
+    def get_level_statistics(self, level: int) -> LevelStatistics:
+        """
+        Returns the counters shared by all nodes of a specified level of the internal tree data structure.
+        """
+        while len(self.level_statistics) <= level:
+            self.level_statistics.append(LevelStatistics())
+        return self.level_statistics[level]
+
+    @property
+    def time(self) -> List[timedelta]:
+        """
+        Time spent on nearest neighbor lookups on each level of the BICO tree, only measured if statistics are activated
+        """
+        return [timedelta(microseconds=level.lookup_time_ns / 1000) for level in self.level_statistics]
+
+    def add_callback(self, event: str, callback: Callable[..., Any]):
+        """
+        Registers a function which is called after an event, e.g. to export statistics.
+        :param event:
+            - 'rebuild': called with this instance and the RebuildStatistics of the rebuild
+            - 'buffer_phase_finished': called with this instance after the initial threshold has been determined and
+              the buffered points have been inserted
+        :param callback:
+            Function to call
+        :return:
+            None
+        """
+        if event not in self.callbacks:
+            raise ValueError('Unknown event {}, expected one of {}'.format(event, ', '.join(self.callbacks)))
+        self.callbacks[event].append(callback)
+
+    def notify(self, event: str, *args):
+        for callback in self.callbacks[event]:
+            callback(self, *args)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns a summary of the data structure and the collected statistics. Counters and lookup times per level are
+        only available if statistics are activated; they include the reinsertions of rebuilds. Node and bucket counts
+        are determined on each call by traversing the tree.
+        :return:
+            Dictionary of numbers and lists which can be serialized as JSON
+        """
+        nodes = [0] * len(self.storages)
+        indexed = [0] * len(self.storages)
+        buckets = [[] for _ in self.storages]
+        for node in self.root.iter_nodes():
+            nodes[node.level] += 1
+            if node.nn_engine is not None:
+                indexed[node.level] += int(bool(node.nn_engine.indexed))
+                buckets[node.level].extend(node.nn_engine.bucket_sizes())
+        levels = []
+        for level in range(max(len(self.storages), len(self.level_statistics))):
+            summary = {'level': level, 'nodes': nodes[level] if level < len(nodes) else 0,
+                       'indexed_nodes': indexed[level] if level < len(indexed) else 0}
+            sizes = buckets[level] if level < len(buckets) else []
+            summary['buckets'] = len(sizes)
+            summary['max_bucket_size'] = max(sizes, default=0)
+            summary['mean_bucket_size'] = float(np.mean(sizes)) if len(sizes) > 0 else 0.0
+            if level < len(self.level_statistics):
+                summary.update(attr.asdict(self.level_statistics[level]))
+            levels.append(summary)
+        return {
+            'num_cfs': self.num_cfs,
+            'threshold': self.thresh,
+            'buffer_phase': self.buffer_phase,
+            'rebuilds': len(self.rebuilds),
+            'rebuilds_avoided': sum(rebuild.rebuilds_avoided for rebuild in self.rebuilds),
+            'threshold_factors': [rebuild.factor for rebuild in self.rebuilds],
+            'rebuild_seconds': [rebuild.duration.total_seconds() for rebuild in self.rebuilds],
+            'threshold_history': list(self.threshold_history),
+            'index_cutoff': self.index_cutoff,
+            'duplicate_cache': None if self.duplicate_cache is None else self.duplicate_cache.stats(),
+            'memory_budget_bytes': self.memory_budget_bytes,
+            'memory_rebuilds': sum(rebuild.reason == 'memory_budget' for rebuild in self.rebuilds),
+            'levels': levels,
+        }
+
+    def memory_usage(self) -> Dict[str, Any]:
+        """
+        Returns the bytes allocated by this instance by level and component, determined by traversing the tree. Python
+        object overhead is estimated, so the numbers are approximate: totals were 92% to 101% of the memory traced by
+        tracemalloc for trees of 6k to 18k clustering features, and about 72% for a tree of 500 where fixed overheads
+        of the instance dominate. Components per level:
+        - 'cfs': the clustering feature storage including preallocated rows
+        - 'nn_indexes': the nearest neighbor structures of the nodes and the projections they share
+        - 'nodes': node objects and their lists of children
+        :return:
+            Dictionary with the 'total' number of bytes, the components of all 'levels' and the bytes of the 'buffer',
+            the dimensionality 'reduction' and the 'duplicate_cache'
+        """
+        levels = [{'level': level, 'cfs': 0, 'nn_indexes': 0, 'nodes': 0}
+                  for level in range(max(len(self.storages), len(self.projections)))]
+        for level, storage in enumerate(self.storages):
+            levels[level]['cfs'] = storage.nbytes()
+        for level, projections in enumerate(self.projections):
+            levels[level]['nn_indexes'] = projections.nbytes
+        for node in self.root.iter_nodes():
+            summary = levels[node.level]
+            # the attribute dict of a node is about three times as large as the object itself, its row index is the
+            # only attribute value which is not shared with other nodes
+            summary['nodes'] += sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node.index) + \
+                sys.getsizeof(node.point_to_biconode)
+            engine = node.nn_engine
+            if engine is not None:
+                summary['nn_indexes'] += engine.nbytes() + sys.getsizeof(engine) + sys.getsizeof(vars(engine))
+        for summary in levels:
+            summary['total'] = summary['cfs'] + summary['nn_indexes'] + summary['nodes']
+        usage = {
+            'buffer': sum(point.p.nbytes if isinstance(point.p, np.ndarray) else
+                          point.p.data.nbytes + point.p.indices.nbytes + point.p.indptr.nbytes for point in self.buffer),
+            'reduction': 0 if self.reduction is None else self.reduction.nbytes,
+            'duplicate_cache': 0 if self.duplicate_cache is None else self.duplicate_cache.nbytes(),
+        }
+        usage['total'] = sum(summary['total'] for summary in levels) + sum(usage.values())
+        usage['levels'] = levels
+        return usage
 
     def get_threshold(self, level: int) -> float:
         """
@@ -155,11 +874,388 @@ class BICO:
         coreset = self.get_coreset()
         np.save(file_name, coreset)
 
-    def get_coreset(self) -> np.ndarray:
+    def get_state(self) -> dict:
+        """
+        Returns the complete state of the data structure as flat numpy arrays. The nodes of the tree are listed in
+        depth-first pre-order by their level, the position of their parent in this order and their clustering feature.
+        :return:
+            Dictionary of numpy arrays as written by save
+        """
+        if self.sparse:
+            raise ValueError('Checkpoints of sparse instances are not supported')
+        nodes, parents = [], []
+        stack = [(node, 0) for node in reversed(self.root.point_to_biconode)]
+        while len(stack) > 0:
+            node, parent = stack.pop()
+            nodes.append(node)
+            parents.append(parent)
+            # the root has position 0
+            stack.extend((child, len(nodes)) for child in reversed(node.point_to_biconode))
+        levels = np.array([node.level for node in nodes], dtype=np.int64)
+        refs = np.empty((len(nodes), self.tree_dimension), dtype=self.dtype)
+        sums = np.empty((len(nodes), self.tree_dimension + self.dimension if self.full_sums else self.tree_dimension))
+        squared = np.empty(len(nodes))
+        sizes = np.empty(len(nodes))
+        for level in np.unique(levels):
+            rows = np.flatnonzero(levels == level)
+            index = [nodes[i].index for i in rows]
+            storage = self.storages[level]
+            refs[rows], sums[rows] = storage.refs[index], storage.sums[index]
+            squared[rows], sizes[rows] = storage.squared[index], storage.sizes[index]
+        algorithm, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        return {
+            'format': np.array(1),
+            'config': np.array([self.dimension, self.number_projections, self.coreset_size], dtype=np.int64),
+            'methods': np.array([self.projection_method, self.rebuild_method]),
+            # reduced dimension (0 if not reduced), seed and full_sums of the dimensionality reduction
+            'reduction': np.array([self.reduce_dim or 0, self.reduce_seed, self.full_sums], dtype=np.int64),
+            'reduction_method': np.array(self.reduce_method),
+            'thresh': np.array(self.thresh, dtype=float),
+            'buffer_phase': np.array(self.buffer_phase),
+            'dtype': np.array(self.dtype.str),
+            'buffer': self.get_buffer(),
+            'projections': np.array(self.projections, dtype=self.dtype).reshape(-1, self.number_projections,
+                                                                         self.tree_dimension),
+            'levels': levels,
+            'parents': np.array(parents, dtype=np.int64),
+            'refs': refs,
+            'sums': sums,
+            'squared': squared,
+            'sizes': sizes,
+            'random_keys': keys,
+            'random_position': np.array([pos, has_gauss]),
+            'random_gaussian': np.array(cached_gaussian),
+        }
+
+    def save(self, file_name: str, blocking: bool = True) -> Optional[threading.Thread]:
+        """
+        Writes a checkpoint of the complete state (tree, threshold, buffer, projections and the state of the numpy
+        random generator) as uncompressed .npz file. The file is written to a temporary file first and then renamed, so
+        an interrupted checkpoint never replaces the previous one.
+        :param file_name:
+            File name of the checkpoint
+        :param blocking:
+            If False, only the state is copied synchronously and the file is written by a background thread such that
+            insertions can continue meanwhile
+        :return:
+            The writing thread if blocking is False
+        """
+        state = self.get_state()
+
+        def write():
+            temporary = file_name + '.tmp'
+            with open(temporary, 'wb') as f:
+                np.savez(f, **state)
+            os.replace(temporary, file_name)
+
+        if blocking:
+            write()
+            return None
+        thread = threading.Thread(target=write)
+        thread.start()
+        return thread
+
+    @classmethod
+    def load(cls, file_name: str, restore_random_state: bool = True, **kwargs) -> 'BICO':
+        """
+        Restores a BICO instance from a checkpoint written by save. The nearest neighbor structures are rebuilt lazily
+        on the first lookup of each node.
+        :param file_name:
+            File name of the checkpoint
+        :param restore_random_state:
+            Restore the state of the numpy random generator such that a resumed run draws the same projections as an
+            uninterrupted one
+        :param kwargs:
+            Further arguments of the BICO constructor like verbose or track_time. They override the stored
+            configuration, e.g. projection_method, rebuild_method or coreset_size. A ValueError is raised if they differ
+            from the stored dimension, number of projections or dimensionality reduction.
+        :return:
+            BICO instance
+        """
+        with np.load(file_name, allow_pickle=False) as checkpoint:
+            state = dict(checkpoint)
+        if int(state['format']) != 1:
+            raise ValueError('Unsupported checkpoint format {}'.format(int(state['format'])))
+        dimension, number_projections, coreset_size = state['config'].tolist()
+        projection_method, rebuild_method = state['methods'].tolist()
+        stored = dict(dimension=dimension, number_projections=number_projections, coreset_size=coreset_size,
+                      projection_method=projection_method, rebuild_method=rebuild_method,
+                      dtype=np.dtype(str(state['dtype'])), reduce_dim=None)
+        if 'reduction' in state:
+            reduce_dim, reduce_seed, full_sums = state['reduction'].tolist()
+            stored.update(reduce_dim=reduce_dim or None, reduce_method=str(state['reduction_method']),
+                          reduce_seed=reduce_seed, full_sums=bool(full_sums))
+        # the stored clustering features only fit the space and the projections they were computed in
+        for name in ('dimension', 'number_projections', 'reduce_dim', 'reduce_method', 'reduce_seed', 'full_sums'):
+            if name in kwargs and name in stored and kwargs[name] != stored[name]:
+                raise ValueError('Checkpoint {} was written with {}={}, got {}'.format(file_name, name, stored[name],
+                                                                                       kwargs[name]))
+        bico = cls(**{**stored, **kwargs})
+        bico.thresh = float(state['thresh'])
+        bico.buffer_phase = bool(state['buffer_phase'])
+        if not bico.buffer_phase:
+            bico.threshold_history.append(bico.thresh)
+        bico.buffer = [Point(row) for row in state['buffer']]
+        bico.projections = list(state['projections'])
+        nodes = [bico.root]
+        for level, parent in zip(state['levels'].tolist(), state['parents'].tolist()):
+            node = BICONode(level, bico.tree_dimension, number_projections, bico, bico.projection_func)
+            nodes[parent].point_to_biconode.append(node)
+            nodes[parent].num_cfs += 1
+            nodes.append(node)
+        levels = state['levels']
+        for level in np.unique(levels):
+            rows = np.flatnonzero(levels == level)
+            # the nodes of a level occupy consecutive rows of the fresh storage in creation order
+            bico.storages[level].set_rows(np.arange(len(rows)), state['refs'][rows], state['sums'][rows],
+                                          state['squared'][rows], state['sizes'][rows])
+        bico.num_cfs = len(levels)
+        if restore_random_state:
+            pos, has_gauss = state['random_position'].tolist()
+            np.random.set_state(('MT19937', state['random_keys'], pos, has_gauss, float(state['random_gaussian'])))
+        return bico
+
+    def get_coreset(self, size: int = None) -> np.ndarray:
         """
         Returns reduced data set
+        :param size:
+            Optional maximum number of points, smaller than coreset_size, see downsize. The tree is not modified.
         :return:
             Returns (coreset size) x (dim+1) dimensional numpy array where each row contains the weight / size in the first column
-            and the reference geometry of a clustering feature in the remaining columns.
+            and the center of a clustering feature in the remaining columns, both of the dtype of this instance. During
+            the buffer phase the buffered points are returned with weight one. In sparse mode the array is a
+            scipy.sparse CSR matrix. If the dimension is reduced without full_sums, the centers are reduced points.
+        """
+        if size is not None:
+            return self.downsize(size)
+        if self.sparse:
+            return self.get_sparse_coreset()
+        if self.buffer_phase:
+            buffer = self.get_buffer() if self.full_sums else self.reduce(self.get_buffer())
+            return np.hstack([np.ones((len(buffer), 1), dtype=self.dtype), buffer])
+        # the storages of the levels below the root hold exactly the clustering features of the tree
+        rows = [(storage, storage.live()) for storage in self.storages[1:]]
+        coreset = np.empty((sum(len(index) for _, index in rows), self.output_dimension + 1), dtype=self.dtype)
+        # the original coordinates follow the reduced ones in the sums of full_sums
+        columns = slice(self.tree_dimension if self.full_sums else 0, None)
+        start = 0
+        for storage, index in rows:
+            end = start + len(index)
+            coreset[start:end, 0] = storage.sizes[index]
+            np.divide(storage.sums[index, columns], coreset[start:end, :1], out=coreset[start:end, 1:])
+            start = end
+        return coreset
+
+    def downsize(self, size: int) -> np.ndarray:
+        """
+        Returns a coreset of at most size points in the format of get_coreset without modifying the tree. The tree is
+        collapsed bottom-up: leaves are merged into the clustering feature of their parent one at a time, the one with
+        the smallest cost w.r.t. the reference point of the parent first, like for a gradually raised threshold. A
+        parent becomes a leaf once all its children are merged. Since every merge removes one clustering feature,
+        exactly size points are returned in time O(n log n) for n clustering features. Only if the children of the root
+        alone are more than size, the collapsed children are inserted into a temporary tree with doubling thresholds
+        like a rebuild, which may return considerably fewer than size points.
+        :param size:
+            Maximum number of points
+        :return:
+            (at most size) x (dim+1) dimensional numpy array
+        """
+        if size < 1:
+            raise ValueError('Size must be positive, got {}'.format(size))
+        if self.sparse:
+            raise ValueError('Downsizing is not supported in sparse mode')
+        if (len(self.buffer) if self.buffer_phase else self.num_cfs) <= size:
+            return self.get_coreset()
+        if self.buffer_phase:
+            return self.__downsize_features(None, size)
+
+        # nodes in pre-order with the index of their parent, the root comes first
+        nodes, parents = [], []
+        stack = [(self.root, 0)]
+        while len(stack) > 0:
+            node, parent = stack.pop()
+            parents.append(parent)
+            stack.extend((child, len(nodes)) for child in node.point_to_biconode)
+            nodes.append(node)
+        levels = np.array([node.level for node in nodes])
+        parents = np.array(parents)
+        index = np.array([node.index for node in nodes])
+        refs = np.zeros((len(nodes), self.tree_dimension))
+        sums = np.zeros((len(nodes), self.get_storage(0).sum_dimension))
+        squared, sizes = np.zeros(len(nodes)), np.zeros(len(nodes))
+        for level in range(1, levels.max() + 1):
+            rows = levels == level
+            storage = self.storages[level]
+            refs[rows], sums[rows] = storage.refs[index[rows]], storage.sums[index[rows]]
+            squared[rows], sizes[rows] = storage.squared[index[rows]], storage.sizes[index[rows]]
+
+        children = np.flatnonzero(levels == 1)
+        if len(children) > size:
+            # every subtree below the root collapses and the children of the root still have to be merged
+            for level in range(levels.max(), 1, -1):
+                rows = np.flatnonzero(levels == level)
+                np.add.at(sums, parents[rows], sums[rows])
+                np.add.at(squared, parents[rows], squared[rows])
+                np.add.at(sizes, parents[rows], sizes[rows])
+            return self.__downsize_features((refs[children].astype(self.dtype), sums[children], squared[children],
+                                             sizes[children]), size)
+
+        # leaves are merged into their parents one at a time, the one which increases the cost the least first; a
+        # parent whose children have all been merged becomes a leaf itself
+        ref_norms = np.einsum('ij,ij->i', refs, refs)
+        num_children = np.bincount(parents[1:], minlength=len(nodes))
+        leaves = []
+        for i in np.flatnonzero((levels > 1) & (num_children == 0)).tolist():
+            leaves.append((self.__merge_cost(sums[i], squared[i], sizes[i], refs[parents[i]], ref_norms[parents[i]]),
+                           i))
+        heapq.heapify(leaves)
+        remaining = len(nodes) - 1
+        alive = levels > 0
+        while remaining > size:
+            _, i = heapq.heappop(leaves)
+            parent = parents[i]
+            sums[parent] += sums[i]
+            squared[parent] += squared[i]
+            sizes[parent] += sizes[i]
+            alive[i] = False
+            remaining -= 1
+            num_children[parent] -= 1
+            if num_children[parent] == 0 and levels[parent] > 1:
+                grandparent = parents[parent]
+                heapq.heappush(leaves, (self.__merge_cost(sums[parent], squared[parent], sizes[parent],
+                                                          refs[grandparent], ref_norms[grandparent]), parent))
+
+        kept = np.flatnonzero(alive)
+        weights = sizes[kept]
+        # the original coordinates follow the reduced ones in the sums of full_sums
+        centers = sums[kept, self.tree_dimension if self.full_sums else 0:] / weights[:, np.newaxis]
+        return np.hstack([weights[:, np.newaxis], centers]).astype(self.dtype)
+
+    def __merge_cost(self, sum: np.ndarray, squared: float, size: float, ref: np.ndarray, ref_norm: float) -> float:
+        """
+        Returns the cost of a clustering feature w.r.t. the reference point of the clustering feature it is merged into
+        """
+        return float(squared - 2 * sum[:self.tree_dimension].dot(ref) + size * ref_norm)
+
+    def __downsize_features(self, features: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]],
+                            size: int) -> np.ndarray:
+        """
+        Returns the coreset of a temporary BICO instance with the configuration of this one and coreset_size size into
+        which the buffered points or clustering features given as (refs, sums, squared, sizes) are inserted
+        """
+        bico = BICO(self.dimension, self.number_projections, size, projection_method=self.projection_method,
+                    rebuild_method=self.rebuild_method, dtype=self.dtype, reduce_dim=self.reduce_dim,
+                    reduce_method=self.reduce_method, reduce_seed=self.reduce_seed, full_sums=self.full_sums,
+                    index_cutoff=self.index_cutoff)
+        bico.projections = list(self.projections)
+        # the projections of further levels must not advance the random generator of the stream
+        state = np.random.get_state()
+        try:
+            if features is None:
+                bico.insert_batch(self.get_buffer())
+            else:
+                bico.buffer_phase = False
+                bico.thresh = self.thresh
+                bico.threshold_history.append(bico.thresh)
+                bico.insert_clustering_features(*features)
+            bico.shrink()
+        finally:
+            np.random.set_state(state)
+        return bico.get_coreset()
+
+    def get_sparse_coreset(self) -> 'scipy.sparse.csr_matrix':
+        """
+        Returns the reduced data set of a sparse instance in the format of get_coreset as CSR matrix
+        """
+        from scipy.sparse import csr_matrix, diags, hstack
+        if self.buffer_phase:
+            weights, centers = np.ones(len(self.buffer)), self.get_buffer()
+        else:
+            rows = [(storage, storage.live()) for storage in self.storages[1:]]
+            weights = np.concatenate([np.zeros(0)] + [storage.sizes[index] for storage, index in rows])
+            sums = self.stack([csr_matrix((0, self.dimension))] + [storage.sums[index] for storage, index in rows])
+            centers = diags(1 / weights).dot(sums)
+        return hstack([csr_matrix(weights[:, np.newaxis]), centers], format='csr', dtype=self.dtype)
+
+    def snapshot(self) -> np.ndarray:
+        """
+        Returns the current coreset as a read-only array in the format of get_coreset. The array is cached and only
+        recomputed after the data structure changed, so it can be polled frequently, e.g. by a monitoring thread while
+        another thread inserts points. A snapshot taken during a concurrent insertion reflects the tree at some point
+        during that insertion. While a concurrent rebuild replaces the tree, the last complete snapshot is returned, and
+        a snapshot is waited for if there is none yet.
+        :return:
+            Read-only (coreset size) x (dim+1) dimensional numpy array
+        """
+        while True:
+            sequence, version = self.__rebuild_sequence, self.version
+            if sequence % 2 == 1:
+                if self.__snapshot is not None:
+                    return self.__snapshot[1]
+                sleep(0.001)
+                continue
+            if self.__snapshot is not None and self.__snapshot[0] == version:
+                return self.__snapshot[1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                coreset = self.get_coreset()
+            if self.__rebuild_sequence != sequence:
+                # a rebuild started while the coreset was extracted and may have released its rows
+                continue
+            # rows which are released or not yet filled by a concurrent insertion have weight zero
+            weights = np.ravel(coreset[:, 0].toarray()) if self.sparse else coreset[:, 0]
+            coreset = coreset[weights > 0]
+            (coreset.data if self.sparse else coreset).setflags(write=False)
+            self.__snapshot = (version, coreset)
+            return coreset
+
+    def fit_kmeans(self, k: int, n_init: int = 10, iterations: int = 100, seed: int = None) -> np.ndarray:
+        """
+        Computes k centers on the current coreset with weighted k-means++ seeding and Lloyd iterations. The centers
+        are kept for predict. The coreset of a sparse instance is densified.
+        :param k:
+            Number of centers
+        :param n_init:
+            Number of runs with different seedings, the centers of the run with the smallest cost are returned
+        :param iterations:
+            Maximum number of Lloyd iterations per run
+        :param seed:
+            Seed of the random generator
+        :return:
+            k x dim numpy array of centers
+        """
+        coreset = self.get_coreset()
+        if self.sparse:
+            coreset = coreset.toarray()
+        self.centers = weighted_kmeans(coreset[:, 1:], k, coreset[:, 0], seed, n_init, iterations)
+        return self.centers
+
+    def predict(self, points: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+        """
+        Assigns points to their closest center computed by fit_kmeans
+        :param points:
+            2-D numpy array or scipy.sparse matrix with one point per row in the original dimension
+        :param chunk_size:
+            Number of points whose distances to all centers are computed at once
+        :return:
+            Index of the closest center for every point
         """
-        return np.vstack(self.root.get_cf())
+        if self.centers is None:
+            raise ValueError('No centers computed yet, call fit_kmeans first')
+        if self.reduction is not None and not self.full_sums:
+            # the centers have been computed on the reduced coreset
+            if not is_sparse(points):
+                points = np.array(points, dtype=self.dtype, ndmin=2, copy=None)
+            points = self.reduce(points)
+        if not is_sparse(points):
+            return predict(points, self.centers, chunk_size)
+        # distances from sparse products, the points are never densified
+        from scipy.sparse import csr_matrix
+        from bico.utils.SparseClusteringFeatureStorage import squared_norms
+        points = csr_matrix(points)
+        center_norms = np.einsum('ij,ij->i', self.centers, self.centers)
+        labels = np.empty(points.shape[0], dtype=np.int64)
+        for start in range(0, points.shape[0], chunk_size):
+            chunk = points[start:start + chunk_size]
+            distances = squared_norms(chunk)[:, np.newaxis] - 2 * np.asarray(chunk.dot(self.centers.T)) + center_norms
+            labels[start:start + chunk_size] = distances.argmin(axis=1)
+        return labels
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+def closest_pair_distance(points: np.ndarray) -> float:
+    """
+    Computes the smallest nonzero squared euclidean distance between two rows of a point set in O(n log n) time by
+    querying a kd-tree of the distinct points for their nearest neighbors. Duplicate points are ignored.
+    :param points:
+        2-D numpy array with one point per row
+    :return:
+        Smallest nonzero squared distance or -1 if there are no two distinct points
+    """
+    # imported here since scipy.spatial dominates the import time of bico.core and is only needed once per run
+    from scipy.spatial import cKDTree
+    from scipy.sparse import issparse
+    if issparse(points):
+        return sparse_closest_pair_distance(points)
+    points = np.unique(np.asarray(points, dtype=float), axis=0)
+    if len(points) < 2:
+        return -1
+    _, neighbors = cKDTree(points).query(points, k=2)
+    d = points - points[neighbors[:, 1]]
+    return float(np.einsum('ij,ij->i', d, d).min())
+
+
+def sparse_closest_pair_distance(points, block_size: int = 1024) -> float:
+    """
+    Computes the smallest nonzero squared euclidean distance between two rows of a scipy.sparse matrix. Since a kd-tree
+    does not work in high dimensions, all pairwise distances are computed from inner products, block_size rows at a time.
+    :param points:
+        scipy.sparse matrix with one point per row
+    :return:
+        Smallest nonzero squared distance or -1 if there are no two distinct points
+    """
+    from scipy.sparse import csr_matrix
+    points = csr_matrix(points, dtype=float, copy=True)
+    points.sum_duplicates()
+    points.eliminate_zeros()
+    # exact duplicates are removed by their nonzero entries such that rounding errors do not produce tiny distances
+    rows = {(points.indices[start:end].tobytes(), points.data[start:end].tobytes()): i
+            for i, (start, end) in enumerate(zip(points.indptr[:-1].tolist(), points.indptr[1:].tolist()))}
+    points = points[sorted(rows.values())]
+    if points.shape[0] < 2:
+        return -1
+    norms = np.ravel(points.multiply(points).sum(axis=1))
+    best, pair = np.inf, None
+    for start in range(0, points.shape[0], block_size):
+        block = slice(start, start + block_size)
+        distances = norms[block, np.newaxis] - 2 * points[block].dot(points.T).toarray() + norms
+        # ignore the distance of each point to itself
+        distances[np.arange(distances.shape[0]), np.arange(start, start + distances.shape[0])] = np.inf
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        if distances[i, j] < best:
+            best, pair = distances[i, j], (start + i, j)
+    # recompute the distance of the closest pair without cancellation
+    diff = points[pair[0]] - points[pair[1]]
+    return float(diff.multiply(diff).sum())
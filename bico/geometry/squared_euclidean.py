@@ -10,9 +10,12 @@ def squared_euclidean_distance(x: np.ndarray, y: np.ndarray) -> np.ndarray:
 
 class SquaredEuclideanDistance(Distance):
     """ Squared Euclidean distance for nearpy data structures """
+    # number of computed distances
+    evaluations = 0
 
     def distance(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
         """
         Computes squared euclidean distance between vectors x and y. Returns float.
         """
+        self.evaluations += 1
         return squared_euclidean_distance(x, y)
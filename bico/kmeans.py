@@ -0,0 +1,111 @@
+import numpy as np
+
+
+def squared_distances(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """
+    Returns the squared Euclidean distance of every point to every center
+    """
+    distances = np.einsum('ij,ij->i', points, points)[:, np.newaxis] - 2 * points.dot(centers.T) + \
+        np.einsum('ij,ij->i', centers, centers)
+    return np.maximum(distances, 0)
+
+
+def kmeans_cost(points: np.ndarray, centers: np.ndarray, weights: np.ndarray = None,
+                chunk_size: int = 65536) -> float:
+    """
+    Returns the (weighted) sum of squared distances of the points to their closest center
+    """
+    cost = 0.0
+    for start in range(0, len(points), chunk_size):
+        closest = squared_distances(points[start:start + chunk_size], centers).min(axis=1)
+        cost += closest.sum() if weights is None else closest.dot(weights[start:start + chunk_size])
+    return cost
+
+
+def predict(points: np.ndarray, centers: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """
+    Assigns every point to its closest center
+    :param points:
+        n x d numpy array
+    :param centers:
+        k x d numpy array
+    :param chunk_size:
+        Number of points whose distances to all centers are computed at once
+    :return:
+        Index of the closest center for every point
+    """
+    points = np.array(points, ndmin=2, copy=None)
+    labels = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), chunk_size):
+        labels[start:start + chunk_size] = squared_distances(points[start:start + chunk_size], centers).argmin(axis=1)
+    return labels
+
+
+def weighted_kmeans(points: np.ndarray, k: int, weights: np.ndarray = None, seed: int = None, n_init: int = 5,
+                    iterations: int = 50) -> np.ndarray:
+    """
+    Weighted k-means++ seeding followed by Lloyd iterations, the best of several runs w.r.t. the weighted cost on the
+    input is returned
+    :param points:
+        n x d numpy array
+    :param k:
+        Number of centers
+    :param weights:
+        Optional weight of each point
+    :param seed:
+        Seed of the random generator, the global numpy random state is not used
+    :param n_init:
+        Number of runs with different seedings
+    :param iterations:
+        Maximum number of Lloyd iterations per run
+    :return:
+        k x d numpy array of centers
+    """
+    random_state = np.random.RandomState(seed)
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) == 0:
+        raise ValueError('Cannot compute centers of an empty point set')
+    weights = np.ones(len(points)) if weights is None else np.asarray(weights, dtype=np.float64)
+    best, best_cost = None, np.inf
+    for _ in range(n_init):
+        centers = lloyd(points, weights, kmeans_plus_plus(points, min(k, len(points)), weights, random_state),
+                        iterations)
+        cost = kmeans_cost(points, centers, weights)
+        if cost < best_cost:
+            best, best_cost = centers, cost
+    return best
+
+
+def kmeans_plus_plus(points: np.ndarray, k: int, weights: np.ndarray,
+                     random_state: np.random.RandomState) -> np.ndarray:
+    """
+    Draws k initial centers with probability proportional to weight times squared distance to the closest center
+    """
+    centers = np.empty((k, points.shape[1]))
+    centers[0] = points[random_state.choice(len(points), p=weights / weights.sum())]
+    closest = squared_distances(points, centers[:1])[:, 0]
+    for i in range(1, k):
+        probabilities = weights * closest
+        total = probabilities.sum()
+        index = random_state.choice(len(points), p=probabilities / total) if total > 0 else \
+            random_state.randint(len(points))
+        centers[i] = points[index]
+        closest = np.minimum(closest, squared_distances(points, centers[i:i + 1])[:, 0])
+    return centers
+
+
+def lloyd(points: np.ndarray, weights: np.ndarray, centers: np.ndarray, iterations: int) -> np.ndarray:
+    """
+    Weighted Lloyd iterations until the centers do not move anymore
+    """
+    k = len(centers)
+    for _ in range(iterations):
+        labels = predict(points, centers)
+        totals = np.bincount(labels, weights=weights, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, weights[:, np.newaxis] * points)
+        updated = np.where(totals[:, np.newaxis] > 0, sums / np.maximum(totals, 1e-300)[:, np.newaxis], centers)
+        if np.allclose(updated, centers):
+            break
+        centers = updated
+    return centers
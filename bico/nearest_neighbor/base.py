@@ -1,7 +1,7 @@
 from abc import abstractmethod, ABC
 import numpy as np
 import attr
-from typing import Any, List
+from typing import Any, List, Optional
 
 
 @attr.s
@@ -13,6 +13,12 @@ class NearestNeighborResult:
 
 class NearestNeighbor(ABC):
     """ Abstract class for nearest neighbor implementation """
+    # cumulative counters of all lookups, implementations which do not count leave them at zero
+    candidates_scanned = 0
+    distance_evaluations = 0
+    # False while queries are answered by a brute-force scan instead of the index, see set_indexed
+    indexed = True
+
     @abstractmethod
     def get_candidates(self, point: np.ndarray) -> List[NearestNeighborResult]:
         """
@@ -24,6 +30,90 @@ class NearestNeighbor(ABC):
         """
         pass
 
+    def get_candidates_batch(self, points: np.ndarray) -> List[List[NearestNeighborResult]]:
+        """
+        Get nearest neighbor candidates for every row of a batch of points
+        :param points:
+            Points represented by 2-D numpy array with one point per row
+        :return:
+            List with the candidates of each row as returned by get_candidates
+        """
+        return [self.get_candidates(point) for point in points]
+
+    def insert_candidates(self, points: np.ndarray, metadata: List[Any]):
+        """
+        Insert a batch of points into the data structure.
+        :param points:
+            Points represented by 2-D numpy array with one point per row
+        :param metadata:
+            Metadata for each row
+        :return:
+            None
+        """
+        for point, data in zip(points, metadata):
+            self.insert_candidate(point, data)
+
+    def set_threshold(self, threshold: float) -> bool:
+        """
+        Adapts the data structure to a new distance threshold without reinserting its points.
+        :param threshold:
+            New distance threshold
+        :return:
+            True if the data structure supports the new threshold, otherwise it has to be rebuilt
+        """
+        return False
+
+    def set_indexed(self, indexed: bool):
+        """
+        Switches between the index and a brute-force scan over all stored points with the same results. A scan is
+        cheaper in time and memory for a few points, switching to the index migrates all stored points into it.
+        Implementations without a scan keep their index.
+        :param indexed:
+            True to maintain the index, False to scan
+        :return:
+            None
+        """
+        pass
+
+    def nbytes(self) -> int:
+        """
+        Returns an estimate of the bytes allocated by the data structure, without the projections passed to the
+        constructor since they are shared. Implementations which cannot tell return 0.
+        """
+        return 0
+
+    def bucket_sizes(self) -> List[int]:
+        """
+        Returns the number of points in each non-empty bucket of the data structure, empty if it has no buckets
+        """
+        return []
+
+    def nearest(self, point: np.ndarray) -> Optional[Any]:
+        """
+        Get the metadata of the best candidate for a single point without building the full candidate list
+        :param point:
+            Point represented by 1-D numpy array
+        :return:
+            Metadata of the first candidate returned by get_candidates or None if there is no candidate
+        """
+        candidates = self.get_candidates(point)
+        return candidates[0].data if len(candidates) > 0 else None
+
+    def get_nearest_batch(self, points: np.ndarray) -> List[Optional[Any]]:
+        """
+        Get the metadata of the best candidate for every row of a batch of points
+        :param points:
+            Points represented by 2-D numpy array with one point per row
+        :return:
+            List with the metadata of the first candidate returned by get_candidates for each row or None if there
+            is no candidate for that row
+        """
+        nearest = []
+        for point in points:
+            candidates = self.get_candidates(point)
+            nearest.append(candidates[0].data if len(candidates) > 0 else None)
+        return nearest
+
     @abstractmethod
     def insert_candidate(self, point: np.ndarray, metadata: Any):
         """
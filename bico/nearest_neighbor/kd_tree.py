@@ -0,0 +1,127 @@
+import numpy as np
+from bico.nearest_neighbor.base import NearestNeighbor, NearestNeighborResult
+from scipy.spatial import cKDTree
+from typing import Any, List, Optional
+
+
+class KDTreeNN(NearestNeighbor):
+    """
+    Exact radius search with a scipy kd-tree. Since a kd-tree cannot be extended, new points are kept in a small
+    unindexed tail which is searched by brute force and merged into the tree once it grows too large.
+    """
+    def __init__(self, dimension: int, number_projections: int, threshold: float, projections: np.ndarray = None,
+                 tail_size: int = 256):
+        """
+        :param dimension:
+            Number of dimensions of input points
+        :param number_projections:
+            Unused, for compatibility with the other nearest neighbor implementations
+        :param threshold:
+            Squared distance threshold for definition nearest: all points within this specific squared distance
+        :param projections:
+            Unused, for compatibility with the other nearest neighbor implementations
+        :param tail_size:
+            Minimum number of unindexed points which triggers a rebuild of the tree. The tree is rebuilt once the tail
+            exceeds this size and an eighth of the indexed points, so rebuilds take amortized logarithmic time.
+        """
+        self.dimension = dimension
+        self.threshold = threshold
+        self.tail_size = tail_size
+        self.size = 0
+        self.points = np.empty((0, dimension), dtype=np.float64 if projections is None else projections.dtype)
+        self.metadata = []
+        # number of points indexed by the tree, the remaining points form the tail
+        self.num_indexed = 0
+        self.tree = None
+
+    def __rebuild(self):
+        self.tree = cKDTree(self.points[:self.size])
+        self.num_indexed = self.size
+
+    def insert_candidate(self, point: np.ndarray, metadata: Any):
+        self.insert_candidates(point[np.newaxis], [metadata])
+
+    def insert_candidates(self, points: np.ndarray, metadata: List[Any]):
+        if self.size + len(points) > len(self.points):
+            capacity = max(4, 2 * self.size, self.size + len(points))
+            self.points = np.resize(self.points, (capacity, self.dimension))
+        self.points[self.size:self.size + len(points)] = points
+        self.metadata.extend(metadata)
+        self.size += len(points)
+        if self.size - self.num_indexed > max(self.tail_size, self.num_indexed // 8):
+            self.__rebuild()
+
+    def set_threshold(self, threshold: float) -> bool:
+        # the tree does not depend on the threshold
+        self.threshold = threshold
+        return True
+
+    def nbytes(self) -> int:
+        # the tree keeps a copy of the indexed points and their permutation, its nodes are not accounted for
+        size = self.points.nbytes
+        if self.tree is not None:
+            size += self.tree.data.nbytes + self.tree.indices.nbytes
+        return size
+
+    def __tail_distances(self, points: np.ndarray) -> np.ndarray:
+        tail = self.points[self.num_indexed:self.size]
+        distances = np.einsum('ij,ij->i', points, points)[:, np.newaxis] - 2 * points.dot(tail.T) + \
+            np.einsum('ij,ij->i', tail, tail)
+        return np.maximum(distances, 0)
+
+    def __nearest_rows(self, points: np.ndarray) -> np.ndarray:
+        """
+        Returns the row of the closest point within the threshold for each query or -1
+        """
+        best = np.full(len(points), -1)
+        best_distances = np.full(len(points), np.inf)
+        if self.num_indexed > 0:
+            distances, rows = self.tree.query(points, k=1, distance_upper_bound=np.sqrt(self.threshold))
+            found = rows < self.num_indexed
+            self.candidates_scanned += int(found.sum())
+            best[found] = rows[found]
+            best_distances[found] = distances[found] ** 2
+        if self.size > self.num_indexed:
+            distances = self.__tail_distances(points)
+            self.candidates_scanned += distances.size
+            self.distance_evaluations += distances.size
+            closest = np.argmin(distances, axis=1)
+            closest_distances = distances[np.arange(len(points)), closest]
+            better = closest_distances < best_distances
+            best[better] = self.num_indexed + closest[better]
+            best_distances[better] = closest_distances[better]
+        best[best_distances >= self.threshold] = -1
+        return best
+
+    def nearest(self, point: np.ndarray) -> Optional[Any]:
+        if self.size == 0:
+            return None
+        row = self.__nearest_rows(point[np.newaxis])[0]
+        return self.metadata[row] if row >= 0 else None
+
+    def get_nearest_batch(self, points: np.ndarray) -> List[Optional[Any]]:
+        if self.size == 0:
+            return [None] * len(points)
+        return [self.metadata[row] if row >= 0 else None for row in self.__nearest_rows(points).tolist()]
+
+    def get_candidates(self, point: np.ndarray) -> List[NearestNeighborResult]:
+        return self.get_candidates_batch(point[np.newaxis])[0]
+
+    def get_candidates_batch(self, points: np.ndarray) -> List[List[NearestNeighborResult]]:
+        candidates = [[] for _ in range(len(points))]
+        if self.size == 0:
+            return candidates
+        rows = [[] for _ in range(len(points))]
+        if self.num_indexed > 0:
+            rows = [list(r) for r in self.tree.query_ball_point(points, np.sqrt(self.threshold))]
+        if self.size > self.num_indexed:
+            for i, tail in zip(*np.nonzero(self.__tail_distances(points) < self.threshold)):
+                rows[i].append(self.num_indexed + tail)
+        for i, (point, row) in enumerate(zip(points, rows)):
+            if len(row) == 0:
+                continue
+            diff = self.points[row] - point
+            distances = np.einsum('ij,ij->i', diff, diff)
+            candidates[i] = [NearestNeighborResult(self.points[row[j]], self.metadata[row[j]], float(distances[j]))
+                             for j in np.argsort(distances, kind='stable') if distances[j] < self.threshold]
+        return candidates
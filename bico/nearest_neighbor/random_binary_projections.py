@@ -4,12 +4,13 @@ from bico.nearest_neighbor.base import NearestNeighbor, NearestNeighborResult
 from nearpy import Engine
 from nearpy.filters import DistanceThresholdFilter
 from nearpy.hashes import RandomBinaryProjections
+from typing import List
 
 
 class RandomBinaryNN(NearestNeighbor):
     """ Nearest neighbor implementation by using random binary trees from nearpy package """
 
-    def __init__(self, dimension: int, number_projections: int, threshold: float):
+    def __init__(self, dimension: int, number_projections: int, threshold: float, projections: np.ndarray = None):
         """
         :param dimension:
             Number of dimensions of input points
@@ -18,11 +19,19 @@ class RandomBinaryNN(NearestNeighbor):
             Trade-off: More projections result in a smaller number of false positives in candidate set
         :param threshold:
             Distance threshold for definition nearest: all points within this specific distance
+        :param projections:
+            Optional number_projections x dimension matrix of hyperplane normals shared with other instances.
+            New normals are drawn if omitted.
         """
         self.rbp = RandomBinaryProjections('rbp', number_projections)
+        if projections is not None:
+            # the engine only draws new normals if the dimension of the hash does not match
+            self.rbp.dim = dimension
+            self.rbp.normals = projections
         self.sqdist = SquaredEuclideanDistance()
+        self.threshold_filter = DistanceThresholdFilter(threshold)
         self.ann_engine = Engine(dimension, lshashes=[self.rbp], distance=self.sqdist,
-                                 vector_filters=[DistanceThresholdFilter(threshold)])
+                                 vector_filters=[self.threshold_filter])
 
     def insert_candidate(self, point: np.ndarray, metadata):
         self.ann_engine.store_vector(point, data=metadata)
@@ -30,3 +39,20 @@ class RandomBinaryNN(NearestNeighbor):
     def get_candidates(self, point: np.ndarray):
         return [NearestNeighborResult(res[0], res[1], res[2])
                 for res in self.ann_engine.neighbours(point)]
+
+    @property
+    def candidates_scanned(self) -> int:
+        # every candidate of the hash buckets is compared to the query
+        return self.sqdist.evaluations
+
+    @property
+    def distance_evaluations(self) -> int:
+        return self.sqdist.evaluations
+
+    def bucket_sizes(self) -> List[int]:
+        return [len(bucket) for buckets in self.ann_engine.storage.buckets.values() for bucket in buckets.values()]
+
+    def set_threshold(self, threshold: float) -> bool:
+        # the binary hashes do not depend on the threshold
+        self.threshold_filter.distance_threshold = threshold
+        return True
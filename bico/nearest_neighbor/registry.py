@@ -0,0 +1,58 @@
+import importlib
+from bico.nearest_neighbor.base import NearestNeighbor
+from typing import Callable, Dict, Union
+
+# nearest neighbor implementations by name, given as 'module:class' paths which are imported on first use such that
+# optional dependencies like nearpy are only loaded if the implementation is requested
+ENGINES = {
+    'simple': 'bico.nearest_neighbor.simple_projection:SimpleProjection',
+    'binary': 'bico.nearest_neighbor.random_binary_projections:RandomBinaryNN',
+    'binary_tree': 'bico.nearest_neighbor.random_binary_tree:RandomBinaryTreeNN',
+    'kdtree': 'bico.nearest_neighbor.kd_tree:KDTreeNN',
+    'sparse': 'bico.nearest_neighbor.sparse_projection:SparseProjection',
+}  # type: Dict[str, Union[str, Callable[..., NearestNeighbor]]]
+
+# packages which have to be installed for an implementation, used for error messages only
+EXTRAS = {
+    'binary': 'nearpy',
+    'binary_tree': 'nearpy',
+}
+
+
+def register_engine(name: str, engine: Union[str, Callable[..., NearestNeighbor]]):
+    """
+    Registers a nearest neighbor implementation which can then be selected by its name as projection method of BICO
+    :param name:
+        Name of the implementation
+    :param engine:
+        Class or factory which is called with (dimension, number_projections, threshold, projections), or its path
+        as 'module:class' string to import it lazily
+    :return:
+        None
+    """
+    ENGINES[name.lower()] = engine
+
+
+def get_engine(name: str) -> Callable[..., NearestNeighbor]:
+    """
+    Returns the nearest neighbor implementation registered under a name and imports it if necessary
+    :param name:
+        Name of the implementation, e.g. 'simple'
+    :return:
+        Class or factory of the implementation
+    """
+    name = name.lower()
+    if name not in ENGINES:
+        raise ValueError('Unknown projection method: {}'.format(name))
+    engine = ENGINES[name]
+    if isinstance(engine, str):
+        module, attribute = engine.split(':')
+        try:
+            engine = getattr(importlib.import_module(module), attribute)
+        except ImportError as e:
+            if name in EXTRAS:
+                raise ImportError("Projection method '{}' requires {}, install it with "
+                                  "pip install bico[{}]".format(name, EXTRAS[name], EXTRAS[name])) from e
+            raise
+        ENGINES[name] = engine
+    return engine
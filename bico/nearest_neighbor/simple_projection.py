@@ -1,12 +1,18 @@
 import numpy as np
-from bico.geometry.squared_euclidean import squared_euclidean_distance
+import sys
 from bico.nearest_neighbor.base import NearestNeighbor, NearestNeighborResult
-from typing import List
+from typing import Any, List, Optional, Tuple
 
 
 class SimpleProjection(NearestNeighbor):
-    """ Nearest neighbor implementation by projecting points into buckets using random dot products """
-    def __init__(self, dimension: int, number_projections: int, threshold_filter: float):
+    """
+    Nearest neighbor implementation by projecting points into buckets using random dot products. All points are kept in
+    one growable matrix. The index keeps the rows sorted by bucket value per projection in one array, so the rows of a
+    bucket are a contiguous slice found by binary search, and single new rows are inserted at their positions. Without
+    index, the bucket values of the query are compared with those of all rows, which is cheaper for a few points.
+    """
+    def __init__(self, dimension: int, number_projections: int, threshold_filter: float,
+                 projections: np.ndarray = None):
         """
         :param dimension:
             Number of dimensions of input points
@@ -15,40 +21,268 @@ class SimpleProjection(NearestNeighbor):
             Trade-off: More projections result in a smaller number of false positives in candidate set
         :param threshold_filter:
             Distance threshold for definition nearest: all points within this specific distance
+        :param projections:
+            Optional number_projections x dimension matrix of random projections shared with other instances.
+            A new matrix is drawn if omitted.
         """
         self.dimension = dimension
         self.number_projections = number_projections
         self.threshold_filter = threshold_filter
-        self.__create_projections()
+        self.indexed = True
+        self.__create_projections(projections)
 
-    def __create_projections(self):
-        self.projections = np.array(list(np.random.standard_normal(self.dimension)
-                                         for _ in range(self.number_projections)))
-        self.buckets = [dict() for _ in range(self.number_projections)]
+    def __create_projections(self, projections: np.ndarray = None):
+        if projections is None:
+            projections = np.array(list(np.random.standard_normal(self.dimension)
+                                        for _ in range(self.number_projections)))
+        self.projections = projections
+        self.size = 0
+        # the points are stored with the precision of the projections
+        self.points = np.empty((0, self.dimension), dtype=projections.dtype)
+        self.bucket_values = np.empty((0, self.number_projections), dtype=int)
+        self.metadata = []
+        self.__clear_sorted()
+
+    def __clear_sorted(self):
+        # the keys of the rows sorted per projection, the projections one after another, and the rows in the same order,
+        # only maintained while indexed. A key is a bucket value plus the key offset of its projection such that all
+        # keys ascend, or the plain bucket value if the keys would overflow. Both arrays grow like the points, only
+        # their first number_projections * size entries are used.
+        self.sorted_keys = np.empty(0, dtype=np.intp)
+        self.sorted_order = np.empty(0, dtype=np.intp)
+        self.key_offsets = None
+        self.key_range = None
+
+    def __sort(self):
+        n = self.size
+        # rows of one bucket are contiguous and in insertion order after a stable sort by bucket value
+        order = np.argsort(self.bucket_values[:n], axis=0, kind='stable').T
+        values = np.take_along_axis(self.bucket_values[:n].T, order, axis=1)
+        self.key_offsets = None
+        if n > 0:
+            low, high = int(values[:, 0].min()), int(values[:, -1].max())
+            # bucket values up to the width of the current ones beyond them are inserted without sorting again
+            margin = max(16, high - low)
+            low, high = low - margin, high + margin
+            # one unused key below and above the range of each projection for bucket values outside of it
+            span = high - low + 3
+            if self.number_projections * span + abs(low) < 2 ** 62:
+                self.key_offsets = np.arange(self.number_projections) * span - low + 1
+                self.key_range = (low - 1, high + 1)
+                values = values + self.key_offsets[:, np.newaxis]
+        capacity = self.number_projections * len(self.bucket_values)
+        self.sorted_keys = np.empty(capacity, dtype=np.intp)
+        self.sorted_order = np.empty(capacity, dtype=np.intp)
+        self.sorted_keys[:values.size] = values.ravel()
+        self.sorted_order[:order.size] = order.ravel()
+
+    def __insert_sorted(self, row: int):
+        """
+        Inserts the last row behind the rows with equal bucket values, all rows are sorted again if a bucket value of
+        the row is outside of the range of the keys
+        """
+        values = self.bucket_values[row]
+        row_values = values.tolist()
+        if self.key_offsets is None or min(row_values) <= self.key_range[0] or max(row_values) >= self.key_range[1] or \
+                len(self.sorted_keys) < self.number_projections * self.size:
+            self.__sort()
+            return
+        used = self.number_projections * row
+        keys = values + self.key_offsets
+        # the keys of the projections ascend, so the positions do as well
+        positions = self.sorted_keys[:used].searchsorted(keys, side='right').tolist()
+        positions.append(used)
+        sorted_keys, sorted_order = self.sorted_keys, self.sorted_order
+        # np.insert copies both arrays, shifting the entries in place behind each position is far cheaper
+        for i, key in reversed(list(enumerate(keys.tolist()))):
+            start, stop = positions[i], positions[i + 1]
+            sorted_keys[start + i + 1:stop + i + 1] = sorted_keys[start:stop]
+            sorted_order[start + i + 1:stop + i + 1] = sorted_order[start:stop]
+            sorted_keys[start + i] = key
+            sorted_order[start + i] = row
+
+    def __bounds(self, bucket_values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the start and end positions in sorted_order of the bucket of each bucket value, which has one column per
+        projection
+        """
+        n = self.size
+        sorted_keys = self.sorted_keys[:self.number_projections * n]
+        if self.key_offsets is not None:
+            low, high = self.key_range
+            # single queries are checked on python integers, which is far cheaper than clamping them
+            values = bucket_values.tolist() if bucket_values.ndim == 1 else None
+            if values is None or min(values) < low or max(values) > high:
+                bucket_values = np.maximum(np.minimum(bucket_values, high), low)
+            keys = bucket_values + self.key_offsets
+            return sorted_keys.searchsorted(keys), sorted_keys.searchsorted(keys, side='right')
+        lower = np.empty(bucket_values.shape, dtype=np.intp)
+        upper = np.empty(bucket_values.shape, dtype=np.intp)
+        for i in range(self.number_projections):
+            values = sorted_keys[i * n:(i + 1) * n]
+            # bucket values are integers, so a bucket ends where the next value would start
+            lower[..., i] = values.searchsorted(bucket_values[..., i]) + i * n
+            upper[..., i] = values.searchsorted(bucket_values[..., i] + 1) + i * n
+        return lower, upper
 
     def project(self, point: np.ndarray) -> np.ndarray:
         return self.projections.dot(point)
 
-    def get_candidates(self, point: np.ndarray) -> List[NearestNeighborResult]:
-        proj_values = self.project(point)
-        bucket_values = self.get_bucket_values(proj_values)
-        smallest_bucket = min([x[1].get(bucket_values[x[0]], [])
-                               for x in enumerate(self.buckets)], key=len)
-        distances = [squared_euclidean_distance(p[0], point) for p in smallest_bucket]
-        res = [NearestNeighborResult(p[0][0], p[0][1], p[1]) for p in zip(smallest_bucket, distances)]
-        return sorted(res, key=lambda x: x.distance)
+    def project_batch(self, points: np.ndarray) -> np.ndarray:
+        return points.dot(self.projections.T)
 
     def get_bucket_values(self, proj_values: np.ndarray) -> np.ndarray:
         return (proj_values / (2 * self.threshold_filter)).astype(int)
 
+    def __smallest_bucket(self, point: np.ndarray) -> np.ndarray:
+        """
+        Returns the rows of the bucket of the point in the first projection with the fewest of them, in ascending order
+        """
+        bucket_values = self.get_bucket_values(self.project(point))
+        if not self.indexed:
+            matches = self.bucket_values[:self.size] == bucket_values
+            return matches[:, matches.sum(axis=0).argmin()].nonzero()[0]
+        lower, upper = self.__bounds(bucket_values)
+        smallest = (upper - lower).argmin()
+        return self.sorted_order[lower[smallest]:upper[smallest]]
+
+    def point(self, row: int) -> np.ndarray:
+        """
+        Returns a stored point as 1-D numpy array
+        """
+        return self.points[row]
+
+    def stored_points(self, rows) -> np.ndarray:
+        """
+        Returns the stored points of several rows, given as index array or slice
+        """
+        return self.points[rows]
+
+    def append_points(self, points: np.ndarray):
+        """
+        Stores a batch of points in the rows following the current size, which is updated by the caller
+        """
+        if self.size + points.shape[0] > len(self.points):
+            capacity = max(4, 2 * self.size, self.size + points.shape[0])
+            self.points = np.resize(self.points, (capacity, self.dimension))
+        self.points[self.size:self.size + points.shape[0]] = points
+
+    def points_nbytes(self) -> int:
+        """
+        Returns the bytes allocated for the stored points
+        """
+        return self.points.nbytes
+
+    def distances(self, rows: List[int], point: np.ndarray) -> np.ndarray:
+        """
+        Returns the squared distances between the stored points of some rows and a point
+        """
+        diff = self.points[rows] - point
+        return np.einsum('ij,ij->i', diff, diff)
+
+    def batch_distances(self, members: np.ndarray, points: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        Returns the squared distances between the stored points of the rows members and the rows query of points
+        """
+        diff = self.points[members] - points[query]
+        return np.einsum('ij,ij->i', diff, diff)
+
+    def get_candidates(self, point: np.ndarray) -> List[NearestNeighborResult]:
+        rows = self.__smallest_bucket(point)
+        self.candidates_scanned += len(rows)
+        self.distance_evaluations += len(rows)
+        if len(rows) == 0:
+            return []
+        distances = self.distances(rows, point)
+        return [NearestNeighborResult(self.point(rows[i]), self.metadata[rows[i]], float(distances[i]))
+                for i in np.argsort(distances, kind='stable')]
+
+    def nearest(self, point: np.ndarray) -> Optional[Any]:
+        rows = self.__smallest_bucket(point)
+        self.candidates_scanned += len(rows)
+        if len(rows) <= 1:
+            return self.metadata[rows[0]] if len(rows) == 1 else None
+        self.distance_evaluations += len(rows)
+        return self.metadata[rows[int(np.argmin(self.distances(rows, point)))]]
+
+    def get_nearest_batch(self, points: np.ndarray) -> List[Optional[Any]]:
+        if self.size == 0:
+            return [None] * points.shape[0]
+        query_values = self.get_bucket_values(self.project_batch(points))
+        rows = np.arange(points.shape[0])
+        if not self.indexed:
+            matches = self.bucket_values[np.newaxis, :self.size] == query_values[:, np.newaxis]
+            smallest = np.argmin(matches.sum(axis=1), axis=1)
+            # members in ascending row order like the rows of a bucket
+            query, members = np.nonzero(matches[rows, :, smallest])
+            count = np.bincount(query, minlength=len(rows))
+            return self.__closest_members(points, rows, query, members, count)
+        lower, upper = self.__bounds(query_values)
+        smallest = np.argmin(upper - lower, axis=1)
+        start = lower[rows, smallest]
+        count = upper[rows, smallest] - start
+
+        # gather all members of the smallest bucket of each query and compute their distances at once
+        query = np.repeat(rows, count)
+        offsets = np.arange(len(query)) - np.repeat(np.cumsum(count) - count, count)
+        members = self.sorted_order[start[query] + offsets]
+        return self.__closest_members(points, rows, query, members, count)
+
+    def __closest_members(self, points: np.ndarray, rows: np.ndarray, query: np.ndarray, members: np.ndarray,
+                          count: np.ndarray) -> List[Optional[Any]]:
+        """
+        Returns the metadata of the closest member for each query given the members of its smallest bucket, grouped by
+        query in ascending order
+        """
+        distances = self.batch_distances(members, points, query)
+        self.candidates_scanned += len(members)
+        self.distance_evaluations += len(members)
+        order = np.lexsort((distances, query))
+        first = np.cumsum(count) - count
+        nearest = [None] * points.shape[0]
+        for row, member in zip(rows[count > 0].tolist(), members[order[first[count > 0]]].tolist()):
+            nearest[row] = self.metadata[member]
+        return nearest
+
+    def nbytes(self) -> int:
+        # metadata are small integers of 28 bytes each
+        return self.points_nbytes() + self.bucket_values.nbytes + sys.getsizeof(self.metadata) + 28 * self.size + \
+            self.sorted_keys.nbytes + self.sorted_order.nbytes
+
+    def bucket_sizes(self) -> List[int]:
+        if not self.indexed:
+            return []
+        return [count for values in self.bucket_values[:self.size].T
+                for count in np.unique(values, return_counts=True)[1].tolist()]
+
     def insert_candidate(self, point: np.ndarray, metadata):
-        proj_values = self.project(point)
-        data_point = (point, metadata)
-        bucket_values = self.get_bucket_values(proj_values)
-        for i, bucket in enumerate(self.buckets):
-            cand_list = bucket.get(bucket_values[i], [])
-            if len(cand_list) > 0:
-                cand_list.append(data_point)
+        self.insert_candidates(point[np.newaxis], [metadata])
+
+    def insert_candidates(self, points: np.ndarray, metadata: List[Any]):
+        if self.size + points.shape[0] > len(self.bucket_values):
+            capacity = max(4, 2 * self.size, self.size + points.shape[0])
+            self.bucket_values = np.resize(self.bucket_values, (capacity, self.number_projections))
+        rows = range(self.size, self.size + points.shape[0])
+        self.append_points(points)
+        self.bucket_values[rows.start:rows.stop] = self.get_bucket_values(self.project_batch(points))
+        self.metadata.extend(metadata)
+        self.size = rows.stop
+        if self.indexed:
+            if len(rows) == 1:
+                self.__insert_sorted(rows.start)
             else:
-                bucket[bucket_values[i]] = [data_point]
+                self.__sort()
+
+    def set_threshold(self, threshold: float) -> bool:
+        self.threshold_filter = threshold
+        self.bucket_values[:self.size] = self.get_bucket_values(self.project_batch(self.stored_points(slice(0, self.size))))
+        if self.indexed:
+            self.__sort()
+        return True
 
+    def set_indexed(self, indexed: bool):
+        if indexed and not self.indexed:
+            self.__sort()
+        elif not indexed:
+            self.__clear_sorted()
+        self.indexed = indexed
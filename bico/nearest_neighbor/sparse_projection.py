@@ -0,0 +1,71 @@
+import numpy as np
+from bico.nearest_neighbor.simple_projection import SimpleProjection
+from scipy.sparse import csr_matrix
+from typing import Any, List
+
+
+class SparseProjection(SimpleProjection):
+    """
+    SimpleProjection for points given as scipy.sparse CSR rows. The points are appended to growable CSR arrays such
+    that memory is proportional to their nonzero entries, projections are sparse-dense products and distances are
+    computed from sparse differences.
+    """
+    def __init__(self, dimension: int, number_projections: int, threshold_filter: float,
+                 projections: np.ndarray = None):
+        super().__init__(dimension, number_projections, threshold_filter, projections)
+        self.points = None
+        self.data = np.empty(0, dtype=self.projections.dtype)
+        self.indices = np.empty(0, dtype=np.int32 if dimension < 2 ** 31 else np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        # CSR matrix of the stored points, recreated after insertions
+        self.matrix = None
+
+    def project(self, point: csr_matrix) -> np.ndarray:
+        # only the columns of the nonzero entries are read, scipy.sparse would copy the transposed projections instead
+        return self.projections[:, point.indices].dot(point.data)
+
+    def project_batch(self, points: csr_matrix) -> np.ndarray:
+        points = csr_matrix(points)
+        products = self.projections.T[points.indices] * points.data[:, np.newaxis]
+        projected = np.zeros((points.shape[0], self.number_projections), dtype=products.dtype)
+        nonempty = np.diff(points.indptr) > 0
+        if nonempty.any():
+            projected[nonempty] = np.add.reduceat(products, points.indptr[:-1][nonempty], axis=0)
+        return projected
+
+    def point(self, row: int) -> np.ndarray:
+        return self.stored_points([row]).toarray()[0]
+
+    def stored_points(self, rows) -> csr_matrix:
+        if self.matrix is None:
+            nnz = self.indptr[self.size]
+            self.matrix = csr_matrix((self.data[:nnz], self.indices[:nnz], self.indptr[:self.size + 1]),
+                                     shape=(self.size, self.dimension), copy=False)
+        return self.matrix[rows]
+
+    def points_nbytes(self) -> int:
+        return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes
+
+    def append_points(self, points: csr_matrix):
+        points = csr_matrix(points)
+        nnz = self.indptr[self.size]
+        if nnz + points.nnz > len(self.data):
+            capacity = max(64, 2 * len(self.data), nnz + points.nnz)
+            self.data = np.resize(self.data, capacity)
+            self.indices = np.resize(self.indices, capacity)
+        if self.size + points.shape[0] + 1 > len(self.indptr):
+            self.indptr = np.resize(self.indptr, max(4, 2 * self.size, self.size + points.shape[0]) + 1)
+        self.data[nnz:nnz + points.nnz] = points.data
+        self.indices[nnz:nnz + points.nnz] = points.indices
+        self.indptr[self.size + 1:self.size + points.shape[0] + 1] = nnz + points.indptr[1:]
+        self.matrix = None
+
+    def distances(self, rows: List[int], point: csr_matrix) -> np.ndarray:
+        return self.batch_distances(np.asarray(rows), point, np.zeros(len(rows), dtype=int))
+
+    def batch_distances(self, members: np.ndarray, points: csr_matrix, query: np.ndarray) -> np.ndarray:
+        diff = self.stored_points(members) - points[query]
+        return np.ravel(diff.multiply(diff).sum(axis=1))
+
+    def insert_candidate(self, point: csr_matrix, metadata: Any):
+        self.insert_candidates(csr_matrix(point), [metadata])
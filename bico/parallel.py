@@ -0,0 +1,151 @@
+import itertools
+import logging
+import multiprocessing
+import numpy as np
+import os
+import queue
+from bico.core import BICO
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Union
+
+logger = logging.getLogger(__name__)
+
+
+def build_coreset(chunks: multiprocessing.Queue, results: multiprocessing.Queue, dimension: int,
+                  number_projections: int, coreset_size: int, kwargs: dict):
+    """
+    Worker process: inserts chunks from a queue into its own BICO tree until it receives None and puts the resulting
+    coreset (or the raised exception) into the result queue.
+    """
+    try:
+        # forked workers inherit the random state of the parent and would draw identical projections
+        np.random.seed()
+        bico = BICO(dimension, number_projections, coreset_size, **kwargs)
+        chunk = chunks.get()
+        while chunk is not None:
+            bico.insert_batch(chunk)
+            chunk = chunks.get()
+        bico.shrink()
+        results.put(bico.get_coreset())
+    except Exception as e:
+        results.put(e)
+
+
+def merge_coresets(first: np.ndarray, second: np.ndarray, number_projections: int, coreset_size: int,
+                   kwargs: dict) -> np.ndarray:
+    """
+    Reduces the union of two weighted coresets to a single coreset.
+    :param first:
+        Weighted coreset as returned by BICO.get_coreset
+    :param second:
+        Weighted coreset of the same dimension
+    :param number_projections:
+        Number of projections for faster nearest neighbor search
+    :param coreset_size:
+        Maximum number of points of the reduction result
+    :param kwargs:
+        Further arguments of the BICO constructor
+    :return:
+        Weighted coreset of the union
+    """
+    return BICO.from_coreset(np.vstack([first, second]), number_projections, coreset_size, **kwargs).get_coreset()
+
+
+def parallel_coreset(data: Union[np.ndarray, Iterable[np.ndarray]], number_projections: int, coreset_size: int,
+                     n_workers: int = None, chunk_size: int = 65536, **kwargs) -> np.ndarray:
+    """
+    Computes a coreset with one BICO tree per worker process and merges the coresets of the workers tree-style.
+    :param data:
+        2-D numpy array with one point per row or an iterable of such chunks
+    :param number_projections:
+        Number of projections for faster nearest neighbor search
+    :param coreset_size:
+        Maximum number of points of the reduction result
+    :param n_workers:
+        Number of worker processes, defaults to the number of CPUs
+    :param chunk_size:
+        Number of rows sent to a worker at once if data is an array
+    :param kwargs:
+        Further arguments of the BICO constructor
+    :return:
+        Returns (coreset size) x (dim+1) dimensional numpy array in the format of BICO.get_coreset
+    """
+    n_workers = n_workers or os.cpu_count()
+    if isinstance(data, np.ndarray):
+        chunks = (data[start:start + chunk_size] for start in range(0, len(data), chunk_size))
+    else:
+        chunks = iter(data)
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError('No input data')
+    dtype = np.dtype(kwargs.get('dtype', np.float64))
+    first = np.array(first, dtype=dtype, ndmin=2)
+    dimension = first.shape[1]
+    if n_workers == 1:
+        bico = BICO(dimension, number_projections, coreset_size, **kwargs)
+        bico.insert_batches(itertools.chain([first], chunks))
+        bico.shrink()
+        return bico.get_coreset()
+
+    context = multiprocessing.get_context()
+    # bounded queue: reading the input blocks while all workers are busy
+    chunk_queue = context.Queue(maxsize=2 * n_workers)
+    results = context.Queue()
+    workers = [context.Process(target=build_coreset, daemon=True,
+                               args=(chunk_queue, results, dimension, number_projections, coreset_size, kwargs))
+               for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+
+    def put(item):
+        while True:
+            try:
+                chunk_queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                # workers only stop before receiving None if they failed
+                if not all(worker.is_alive() for worker in workers):
+                    try:
+                        result = results.get(timeout=1)
+                    except queue.Empty:
+                        raise RuntimeError('BICO worker process died')
+                    raise result if isinstance(result, Exception) else RuntimeError('BICO worker stopped early')
+
+    try:
+        for chunk in itertools.chain([first], chunks):
+            put(np.asarray(chunk, dtype=dtype))
+        for _ in workers:
+            put(None)
+        coresets = []
+        while len(coresets) < n_workers:
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                if any(worker.exitcode not in (None, 0) for worker in workers):
+                    raise RuntimeError('BICO worker process died')
+                continue
+            if isinstance(result, Exception):
+                raise result
+            coresets.append(result)
+    except BaseException:
+        # the feeder threads of the queues would otherwise wait for unconsumed chunks at interpreter exit
+        for pending in (chunk_queue, results):
+            pending.cancel_join_thread()
+            pending.close()
+        raise
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        while len(coresets) > 1:
+            logger.info("Merging {} coresets".format(len(coresets)))
+            merged = list(executor.map(merge_coresets, coresets[0::2], coresets[1::2],
+                                       itertools.repeat(number_projections), itertools.repeat(coreset_size),
+                                       itertools.repeat(kwargs)))
+            if len(coresets) % 2 == 1:
+                merged.append(coresets[-1])
+            coresets = merged
+    return coresets[0]
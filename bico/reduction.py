@@ -0,0 +1,39 @@
+import numpy as np
+from math import sqrt
+
+METHODS = ('gaussian', 'achlioptas')
+
+
+def random_projection(input_dimension: int, output_dimension: int, method: str = 'gaussian', seed: int = 0,
+                      dtype: np.dtype = np.float64) -> np.ndarray:
+    """
+    Draws a Johnson-Lindenstrauss random projection. Points are reduced by multiplying them with the transposed matrix.
+    For any n points and output_dimension >= 8 ln(n) / eps^2, all squared distances are preserved up to a factor of
+    1 +- eps with probability at least 1 - 1/n. The k-means cost of every partition into k clusters is preserved up to
+    1 +- eps already for output_dimension = O(log(k / eps) / eps^2), independent of n and of the input dimension
+    (Makarychev, Makarychev and Razenshteyn, STOC 2019).
+    :param input_dimension:
+        Dimension of the input points
+    :param output_dimension:
+        Dimension of the reduced points
+    :param method:
+        - 'gaussian': independent standard normal entries (default)
+        - 'achlioptas': entries +1, 0, -1 with probabilities 1/6, 2/3, 1/6, i.e. two thirds of the entries vanish and
+          the remaining ones are signs. The guarantee is the same as for gaussian entries.
+    :param seed:
+        Seed of the random generator. Projections drawn with the same seed are identical, so points reduced by
+        different instances can be merged.
+    :param dtype:
+        Type of the matrix
+    :return:
+        output_dimension x input_dimension numpy array, scaled such that squared norms are preserved in expectation
+    """
+    random = np.random.RandomState(seed)
+    if method == 'gaussian':
+        projection = random.standard_normal((output_dimension, input_dimension))
+    elif method == 'achlioptas':
+        projection = sqrt(3) * random.choice([-1.0, 0.0, 1.0], size=(output_dimension, input_dimension),
+                                             p=[1 / 6, 2 / 3, 1 / 6])
+    else:
+        raise ValueError('Unknown reduction method {}, expected one of {}'.format(method, ', '.join(METHODS)))
+    return (projection / sqrt(output_dimension)).astype(dtype)
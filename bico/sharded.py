@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import numpy as np
+import os
+import queue
+import threading
+from bico.core import BICO
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+
+class Shard:
+    """
+    BICO instance fed by its own worker thread from a bounded queue of chunks. The lock protects the instance against
+    concurrent queries.
+    """
+
+    def __init__(self, bico: BICO, queue_size: int):
+        self.bico = bico
+        self.lock = threading.Lock()
+        self.chunks = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            chunk = self.chunks.get()
+            try:
+                if chunk is None:
+                    return
+                if self.error is None:
+                    with self.lock:
+                        self.bico.insert_batch(chunk)
+            except Exception as e:
+                logger.exception("Insertion into shard failed")
+                self.error = e
+            finally:
+                self.chunks.task_done()
+
+
+class ShardedBICO:
+    """
+    Thread-safe BICO front end for several producers. Points are routed to independent BICO instances (shards), each
+    fed by a worker thread from a bounded queue, so producers block (or await) when the shards fall behind. The
+    coreset is the union of the shard coresets, reduced to coreset_size if necessary.
+    """
+
+    def __init__(self, dimension: int, number_projections: int, coreset_size: int, n_shards: int = None,
+                 queue_size: int = 4, routing: str = 'projection', seed: int = None, **kwargs):
+        """
+        :param dimension:
+            Dimension of input points
+        :param number_projections:
+            Number of projections for faster nearest neighbor search
+        :param coreset_size:
+            Maximum number of points of each shard and of the merged coreset
+        :param n_shards:
+            Number of shards, defaults to the number of CPUs
+        :param queue_size:
+            Number of chunks which may wait for each shard before producers are blocked
+        :param routing:
+            How points are assigned to shards:
+            - 'projection': points are hashed by their position along a random direction such that close points
+              usually end up in the same shard (default)
+            - 'round_robin': whole batches are assigned to the shards in turn
+        :param seed:
+            Seed of the private random generator which draws the direction of the projection routing, the global numpy
+            random state is not used
+        :param kwargs:
+            Further arguments of the BICO constructor
+        """
+        if routing not in ('projection', 'round_robin'):
+            raise ValueError('Unknown routing: {}'.format(routing))
+        self.dimension = dimension
+        self.number_projections = number_projections
+        self.coreset_size = coreset_size
+        self.routing = routing
+        self.kwargs = kwargs
+        self.shards = [Shard(BICO(dimension, number_projections, coreset_size, **kwargs), queue_size)
+                       for _ in range(n_shards or os.cpu_count())]
+        self.rng = np.random.default_rng(seed)
+        self.direction = self.rng.standard_normal(dimension)
+        # stripe width along the direction, estimated from the first batch
+        self.width = None
+        self.next_shard = 0
+        self.routing_lock = threading.Lock()
+        # held while the chunks of a batch are queued, get_coreset holds it to see either all or none of them
+        self.insert_lock = threading.Lock()
+        # runs insert_batch and flush for coroutines, which block on full queues while holding insert_lock and would
+        # otherwise occupy the default executor of the event loop
+        self.executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='ShardedBICO')
+        self.closed = False
+
+    def route(self, points: np.ndarray) -> List[np.ndarray]:
+        """
+        Splits a batch of points into one chunk per shard
+        :param points:
+            2-D numpy array with one point per row
+        :return:
+            List with the chunk of each shard, empty chunks are None
+        """
+        chunks = [None] * len(self.shards)
+        if self.routing == 'round_robin':
+            with self.routing_lock:
+                shard = self.next_shard
+                self.next_shard = (shard + 1) % len(self.shards)
+            chunks[shard] = points
+            return chunks
+        values = points.dot(self.direction)
+        with self.routing_lock:
+            if self.width is None:
+                spread = float(np.std(values))
+                # a few stripes per shard within two standard deviations
+                self.width = spread / len(self.shards) if spread > 0 else 1.0
+        shards = np.floor(values / self.width).astype(np.int64) % len(self.shards)
+        for shard in np.unique(shards):
+            chunks[shard] = points[shards == shard]
+        return chunks
+
+    def __check(self):
+        if self.closed:
+            raise RuntimeError('ShardedBICO is closed')
+        for shard in self.shards:
+            if shard.error is not None:
+                raise shard.error
+
+    def insert_batch(self, points: np.ndarray):
+        """
+        Insert a batch of points. Blocks while the queue of a target shard is full. Can be called from several
+        threads at once.
+        :param points:
+            2-D numpy array with one point per row
+        :return:
+            None
+        """
+        self.__check()
+        points = np.array(points, ndmin=2, copy=None)
+        if points.shape[1] != self.dimension:
+            raise ValueError('Expected points of dimension {}, got {}'.format(self.dimension, points.shape[1]))
+        chunks = self.route(points)
+        with self.insert_lock:
+            for shard, chunk in zip(self.shards, chunks):
+                if chunk is not None:
+                    shard.chunks.put(chunk)
+
+    async def insert_many(self, points: np.ndarray):
+        """
+        Insert a batch of points from a coroutine. Waits without blocking the event loop while the queue of a target
+        shard is full.
+        :param points:
+            2-D numpy array with one point per row
+        :return:
+            None
+        """
+        self.__check()
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.insert_batch, points)
+
+    def flush(self):
+        """
+        Waits until all queued points have been inserted
+        :return:
+            None
+        """
+        for shard in self.shards:
+            shard.chunks.join()
+        self.__check()
+
+    async def flush_async(self):
+        """
+        Waits until all queued points have been inserted without blocking the event loop
+        :return:
+            None
+        """
+        self.__check()
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.flush)
+
+    def get_coreset(self) -> np.ndarray:
+        """
+        Waits for all queued points and merges the shard coresets. Producers are blocked from queueing further batches
+        until the queues are drained and all shards are locked in a fixed order, so the result covers exactly the
+        batches queued before, each of them in every shard it was routed to.
+        :return:
+            (coreset size) x (dim+1) dimensional numpy array in the format of BICO.get_coreset
+        """
+        with self.insert_lock:
+            self.flush()
+            for shard in self.shards:
+                shard.lock.acquire()
+            try:
+                coreset = np.vstack([shard.bico.get_coreset() for shard in self.shards])
+            finally:
+                for shard in reversed(self.shards):
+                    shard.lock.release()
+        if len(coreset) <= self.coreset_size:
+            return coreset
+        return BICO.from_coreset(coreset, self.number_projections, self.coreset_size, **self.kwargs).get_coreset()
+
+    def close(self):
+        """
+        Inserts the queued points and stops the worker threads and the executor of the coroutines
+        :return:
+            None
+        """
+        if self.closed:
+            return
+        self.closed = True
+        # batches handed to the executor before are still queued while the workers run
+        self.executor.shutdown(wait=True)
+        for shard in self.shards:
+            shard.chunks.put(None)
+        for shard in self.shards:
+            shard.thread.join()
+
+    def __enter__(self) -> 'ShardedBICO':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
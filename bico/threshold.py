@@ -0,0 +1,81 @@
+import numpy as np
+from abc import ABC, abstractmethod
+from math import log
+from typing import Union
+
+
+class ThresholdPolicy(ABC):
+    """ Decides by how much the threshold is raised when the tree holds too many clustering features """
+
+    @abstractmethod
+    def next_threshold(self, bico: 'BICO') -> float:
+        """
+        :param bico:
+            BICO instance that is about to be rebuilt, its rebuilds attribute lists the previous rebuilds
+        :return:
+            New threshold, larger than the current one
+        """
+        pass
+
+
+class DoublingPolicy(ThresholdPolicy):
+    """ Doubles the threshold, the rule of the original BICO algorithm """
+
+    def next_threshold(self, bico: 'BICO') -> float:
+        return 2.0 * bico.thresh
+
+
+class TargetFillPolicy(ThresholdPolicy):
+    """
+    Raises the threshold by the factor expected to leave fill * coreset_size clustering features after the rebuild,
+    such that neither repeated rebuilds in a row nor a rebuild shortly afterwards are needed. The number of clustering
+    features is modeled to shrink with a power of the threshold whose exponent is measured by the previous rebuild
+    (number of clustering features before and after, and the factor the threshold was raised by). Without a previous
+    rebuild the threshold is doubled.
+
+    BICO bounds the threshold in terms of the optimal k-means cost at the time it is raised. A factor F instead of two
+    weakens this bound and thus the approximation guarantee by at most F / 2, so the factor is limited to max_factor.
+    It is never smaller than two, so the tree shrinks at least as fast as with doubling.
+    """
+
+    def __init__(self, fill: float = 0.7, max_factor: float = 8.0):
+        """
+        :param fill:
+            Targeted number of clustering features after the rebuild as fraction of coreset_size
+        :param max_factor:
+            Maximum factor by which the threshold is raised at once, at least two
+        """
+        if not 0 < fill <= 1:
+            raise ValueError('Fill must be in (0, 1], got {}'.format(fill))
+        if max_factor < 2:
+            raise ValueError('Maximum factor must be at least 2, got {}'.format(max_factor))
+        self.fill = fill
+        self.max_factor = max_factor
+
+    def next_threshold(self, bico: 'BICO') -> float:
+        previous = next((rebuild for rebuild in reversed(bico.rebuilds) if rebuild.factor > 1), None)
+        if previous is None or previous.num_cfs_after == 0:
+            return 2.0 * bico.thresh
+        # exponent of the power law num_cfs ~ threshold^(-exponent), clamped against noisy measurements
+        exponent = log(max(previous.num_cfs_before, 1) / max(previous.num_cfs_after, 1)) / log(previous.factor)
+        exponent = float(np.clip(exponent, 0.1, 10.0))
+        target = max(self.fill * bico.coreset_size, 1)
+        factor = (bico.num_cfs / target) ** (1 / exponent)
+        return float(np.clip(factor, 2.0, self.max_factor)) * bico.thresh
+
+
+POLICIES = {
+    'double': DoublingPolicy,
+    'target_fill': TargetFillPolicy,
+}
+
+
+def get_policy(policy: Union[str, ThresholdPolicy]) -> ThresholdPolicy:
+    """
+    Returns a threshold policy given by its name ('double' or 'target_fill' with default parameters) or as instance
+    """
+    if isinstance(policy, ThresholdPolicy):
+        return policy
+    if policy not in POLICIES:
+        raise ValueError('Unknown threshold policy {}, expected one of {}'.format(policy, ', '.join(POLICIES)))
+    return POLICIES[policy]()
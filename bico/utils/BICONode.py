@@ -1,92 +1,315 @@
 import logging
 import numpy as np
-from bico.geometry.point import Point
 from bico.nearest_neighbor.base import NearestNeighbor
 from bico.utils.ClusteringFeature import ClusteringFeature
-from datetime import datetime
-from typing import Callable, TextIO, List
+from time import perf_counter_ns
+from typing import Callable, Iterator, TextIO, List
 
 logger = logging.getLogger(__name__)
 
 
+def greedy_absorption(costs: np.ndarray, budget: float) -> np.ndarray:
+    """
+    Decides which of a sequence of insertions a clustering feature absorbs when they are tested one after another
+    :param costs:
+        Increase of the 1-means cost of the clustering feature caused by each insertion
+    :param budget:
+        Remaining cost until the threshold of the clustering feature is reached
+    :return:
+        Boolean mask of the absorbed insertions
+    """
+    absorbed = np.zeros(len(costs), dtype=bool)
+    start = 0
+    while start < len(costs):
+        cumulative = np.cumsum(costs[start:])
+        fits = cumulative < budget
+        prefix = len(fits) if fits.all() else int(np.argmin(fits))
+        if prefix > 0:
+            absorbed[start:start + prefix] = True
+            budget -= cumulative[prefix - 1]
+        # the insertion at start + prefix does not fit; find the next one that still does
+        following = np.flatnonzero(costs[start + prefix + 1:] < budget)
+        if len(following) == 0:
+            break
+        start += prefix + 1 + following[0]
+    return absorbed
+
+
 class BICONode:
     def __init__(self, level: int, dim: int, proj: int, bico: 'BICO',
-                 projection_func: Callable[[int, int, float], NearestNeighbor]):
+                 projection_func: Callable[[int, int, float, np.ndarray], NearestNeighbor]):
         self.level = level
         self.dim = dim
         self.proj = proj
         self.point_to_biconode = []
         self.projection_func = projection_func
-        self.nn_engine = projection_func(dim, proj, bico.get_radius(self.level))
+        # created on the first lookup among the children since most nodes remain leaves
+        self.nn_engine = None
         self.num_cfs = 0
         self.bico = bico
-        self.cf = ClusteringFeature(Point(np.zeros(dim)), Point(np.zeros(dim)), 0, 0)
+        # shared counters of the level, None if statistics are deactivated
+        self.stats = bico.get_level_statistics(level) if bico.collect_stats else None
+        # the clustering feature of this node is a row of the storage of its level
+        self.storage = bico.get_storage(level)
+        self.index = self.storage.allocate()
+
+    @property
+    def cf(self) -> ClusteringFeature:
+        return self.storage.view(self.index)
+
+    @cf.setter
+    def cf(self, cf: ClusteringFeature):
+        self.storage.set(self.index, cf.ref.p, cf.sum.p, cf.squared, cf.size)
 
     def insert_point(self, point_cf: ClusteringFeature) -> int:
+        return self.insert(point_cf.ref.p, point_cf.sum.p, point_cf.squared, point_cf.size)
+
+    def insert(self, ref: np.ndarray, sum: np.ndarray, squared: float, size: float) -> int:
+        """
+        Insert a single clustering feature into the subtree of this node.
+        :param ref:
+            Reference point of the clustering feature
+        :param sum:
+            Sum of all points in the clustering feature
+        :param squared:
+            Sum of self inner products for all points
+        :param size:
+            Number of points represented by the clustering feature
+        :return:
+            Number of new clustering features
+        """
         if self.bico.verbose:
-            logger.debug("Insert point: {}".format(point_cf))
+            logger.debug("Insert point: %s", ref)
+        stats = self.stats
+        if stats is not None:
+            stats.inserts += 1
         # check whether geometry fits into CF
-        if self.level > 0:
-            if self.cf.size == 0:
-                self.cf += point_cf
-                self.cf.ref = point_cf.ref
-            else:
-                test = self.cf + point_cf
-                cost = test.kmeans_cost(self.cf.ref)
-                if self.bico.verbose:
-                    logger.debug("Cost: " + str(cost) + ", Thresh: " + str(self.bico.get_threshold(self.level)))
-                if cost < self.bico.get_threshold(self.level):
-                    self.cf = test
-                    return 0
+        if self.level > 0 and self.absorb(ref, sum, squared, size):
+            return 0
 
         # search nearest neighbor and insert geometry there or open new BICONode
-        candidates = []
+        nearest = None
         if self.num_cfs > 0:
-            if self.bico.track_time:
-                tstart = datetime.now()
-            candidates = self.nn_engine.get_candidates(point_cf.ref.p)
-            # candidates = self.ann_engine.neighbours(point_cf.ref.p)
-            if self.bico.track_time:
-                tend = datetime.now()
-                if len(self.bico.time) < self.level + 1:
-                    self.bico.time.append(tend - tstart)
-                else:
-                    self.bico.time[self.level] += tend - tstart
-        if len(candidates) == 0:
+            if self.nn_engine is None:
+                self.index_children(self.point_to_biconode)
+            if stats is None:
+                nearest = self.nn_engine.nearest(ref)
+            else:
+                engine = self.nn_engine
+                scanned, evaluated = engine.candidates_scanned, engine.distance_evaluations
+                tstart = perf_counter_ns()
+                nearest = engine.nearest(ref)
+                stats.lookup_time_ns += perf_counter_ns() - tstart
+                stats.lookups += 1
+                stats.candidates_scanned += engine.candidates_scanned - scanned
+                stats.distance_evaluations += engine.distance_evaluations - evaluated
+        if nearest is None:
             if self.bico.verbose:
                 logger.debug("No nearest neighbor found.")
-            self.num_cfs += 1
-            self.nn_engine.insert_candidate(point=point_cf.ref.p, metadata=self.num_cfs)
-            # self.ann_engine.store_vector(point_cf.ref.p, data=self.num_cfs)
-            new_node = BICONode(self.level + 1, self.dim, self.proj, self.bico, self.projection_func)
-            # new_node.cf = ClusteringFeature(geometry, geometry, geometry*geometry, 1)
-            new_node.cf = point_cf
-            # debug
-            if len(self.point_to_biconode) != self.num_cfs - 1:
-                logger.error("Something is wrong: {} != {}".format(len(self.point_to_biconode), self.num_cfs - 1))
-            self.point_to_biconode.append(new_node)
-            return 1
+            return self.open_node(ref, sum, squared, size)
         else:
             if self.bico.verbose:
-                logger.debug(str(len(candidates)) + " nearest neighbor found!")
-                logger.debug(candidates)
-            nearest = candidates[0]
-            node = nearest.data  # contains the index
+                logger.debug("Nearest neighbor found: %s", nearest)
+            node = nearest  # contains the index
             # sanity check
             if len(self.point_to_biconode) < node - 2:
                 logger.error("Something is wrong: {} > {}".format(len(self.point_to_biconode), node - 2))
-            return self.point_to_biconode[node - 1].insert_point(point_cf)
+            return self.point_to_biconode[node - 1].insert(ref, sum, squared, size)
 
-    def output_cf(self, f: TextIO) -> None:
+    def absorb(self, ref: np.ndarray, sum: np.ndarray, squared: float, size: float) -> bool:
+        """
+        Adds a clustering feature to the clustering feature of this node if its cost stays below the threshold. The
+        node is recorded as absorbing_node of the BICO instance.
+        :return:
+            True if the clustering feature was absorbed
+        """
+        storage = self.storage
+        if storage.sizes[self.index] == 0:
+            storage.set(self.index, ref, sum, squared, size)
+            self.bico.absorbing_node = self
+            return True
+        cost = storage.insertion_cost(self.index, sum, squared, size)
+        if self.bico.verbose:
+            logger.debug("Cost: %s, Thresh: %s", storage.costs[self.index] + cost, self.bico.get_threshold(self.level))
+        if storage.costs[self.index] + cost < self.bico.get_threshold(self.level):
+            storage.add(self.index, sum, squared, size, cost)
+            if self.stats is not None:
+                self.stats.absorptions += 1
+            self.bico.absorbing_node = self
+            return True
+        return False
+
+    def open_node(self, ref: np.ndarray, sum: np.ndarray, squared: float, size: float) -> int:
+        """
+        Opens a new child node for a clustering feature without a nearest neighbor among the existing children
+        :return:
+            Number of new clustering features
+        """
+        if self.nn_engine is None:
+            self.nn_engine = self.create_engine(1)
+        self.num_cfs += 1
+        if self.stats is not None:
+            self.stats.opened += 1
+        self.nn_engine.insert_candidate(point=ref.copy(), metadata=self.num_cfs)
+        if not self.nn_engine.indexed and self.num_cfs > self.bico.index_cutoff:
+            self.nn_engine.set_indexed(True)
+            if self.stats is not None:
+                self.stats.migrations += 1
+        # self.ann_engine.store_vector(point_cf.ref.p, data=self.num_cfs)
+        new_node = BICONode(self.level + 1, self.dim, self.proj, self.bico, self.projection_func)
+        new_node.storage.set(new_node.index, ref, sum, squared, size)
+        self.bico.absorbing_node = new_node
+        # debug
+        if len(self.point_to_biconode) != self.num_cfs - 1:
+            logger.error("Something is wrong: {} != {}".format(len(self.point_to_biconode), self.num_cfs - 1))
+        self.point_to_biconode.append(new_node)
+        return 1
+
+    def insert_batch(self, refs: np.ndarray, sums: np.ndarray, squared: np.ndarray, sizes: np.ndarray) -> int:
+        """
+        Insert a batch of clustering features into the subtree of this node. Cost tests and nearest neighbor lookups are
+        done for the whole batch at once, only insertions that open new nodes fall back to insert.
+        :param refs:
+            Reference points of the clustering features, one per row
+        :param sums:
+            Sums of the clustering features, one per row
+        :param squared:
+            Squared sums of the clustering features
+        :param sizes:
+            Sizes of the clustering features
+        :return:
+            Number of new clustering features
+        """
+        stats = self.stats
+        if stats is not None:
+            stats.inserts += len(sizes)
         if self.level > 0:
-            f.write(str(self.cf) + "\n")
-        for node in self.point_to_biconode:
-            node.output_cf(f)
+            storage = self.storage
+            costs = storage.insertion_costs(self.index, sums, squared, sizes)
+            absorbed = greedy_absorption(costs, self.bico.get_threshold(self.level) - storage.costs[self.index])
+            if absorbed.any():
+                storage.add_batch(self.index, sums[absorbed], squared[absorbed], sizes[absorbed], costs[absorbed])
+                if stats is not None:
+                    stats.absorptions += int(absorbed.sum())
+                remaining = ~absorbed
+                refs, sums, squared, sizes = refs[remaining], sums[remaining], squared[remaining], sizes[remaining]
+        if len(sizes) == 0:
+            return 0
+
+        new_cfs = 0
+        pending = np.arange(len(sizes))
+        while len(pending) > 0:
+            if self.num_cfs > 0:
+                if self.nn_engine is None:
+                    self.index_children(self.point_to_biconode)
+                if stats is None:
+                    nearest = self.nn_engine.get_nearest_batch(refs[pending])
+                else:
+                    engine = self.nn_engine
+                    scanned, evaluated = engine.candidates_scanned, engine.distance_evaluations
+                    tstart = perf_counter_ns()
+                    nearest = engine.get_nearest_batch(refs[pending])
+                    stats.lookup_time_ns += perf_counter_ns() - tstart
+                    stats.lookups += len(pending)
+                    stats.candidates_scanned += engine.candidates_scanned - scanned
+                    stats.distance_evaluations += engine.distance_evaluations - evaluated
+                children = np.array([0 if node is None else node for node in nearest])
+                found = children > 0
+                for child in np.unique(children[found]):
+                    idx = pending[children == child]
+                    new_cfs += self.point_to_biconode[child - 1].insert_batch(refs[idx], sums[idx], squared[idx],
+                                                                             sizes[idx])
+                resolved = found.sum()
+                pending = pending[~found]
+            else:
+                resolved = len(pending)
+            if len(pending) == 0:
+                break
+            # the first unresolved insertion opens a new node which may attract the following ones
+            head = pending[0]
+            new_cfs += self.open_node(refs[head], sums[head], squared[head], sizes[head])
+            pending = pending[1:]
+            if self.bico.batch_fallback_ratio * resolved < len(pending):
+                # most insertions open new nodes, so looking them up as a batch does not pay off
+                if stats is not None:
+                    # insert counts these insertions again
+                    stats.inserts -= len(pending)
+                for i in pending:
+                    new_cfs += self.insert(refs[i], sums[i], squared[i], sizes[i])
+                break
+        return new_cfs
+
+    def merge_children(self) -> int:
+        """
+        Merges the leaf children of this node after the threshold has been raised. The leaves are reinserted as a batch
+        into this node such that they are absorbed by its clustering feature or merge with close siblings. Inner
+        children keep their subtrees.
+        :return:
+            Change of the number of clustering features
+        """
+        leaves = [node for node in self.point_to_biconode if node.num_cfs == 0]
+        if len(leaves) == 0:
+            if self.nn_engine is not None and not self.nn_engine.set_threshold(self.bico.get_radius(self.level)):
+                self.index_children(self.point_to_biconode)
+            return 0
+        storage = leaves[0].storage
+        index = np.array([node.index for node in leaves])
+        refs, sums, squared, sizes = storage.refs[index], storage.sums[index], storage.squared[index], \
+            storage.sizes[index]
+        storage.release(index)
+        self.index_children([node for node in self.point_to_biconode if node.num_cfs > 0])
+        return self.insert_batch(refs, sums, squared, sizes) - len(leaves)
+
+    def index_children(self, nodes: List['BICONode']):
+        """
+        Replaces the children of this node and rebuilds the nearest neighbor structure for the current radius
+        :param nodes:
+            New children
+        """
+        self.point_to_biconode = list(nodes)
+        self.num_cfs = len(nodes)
+        self.nn_engine = None
+        if len(nodes) > 0:
+            self.nn_engine = self.create_engine(len(nodes))
+            storage = nodes[0].storage
+            self.nn_engine.insert_candidates(storage.refs[[node.index for node in nodes]],
+                                             list(range(1, len(nodes) + 1)))
+
+    def create_engine(self, num_children: int) -> NearestNeighbor:
+        """
+        Creates the nearest neighbor structure for the children of this node for the current radius. It scans its
+        points by brute force as long as the node has at most index_cutoff children.
+        :param num_children:
+            Number of children which are about to be inserted
+        """
+        engine = self.projection_func(self.dim, self.proj, self.bico.get_radius(self.level),
+                                      self.bico.get_projections(self.level))
+        engine.set_indexed(num_children > self.bico.index_cutoff)
+        return engine
+
+    def iter_nodes(self) -> Iterator['BICONode']:
+        """
+        Iterates over the subtree of this node in depth-first pre-order without recursion
+        """
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.point_to_biconode))
+
+    def output_cf(self, f: TextIO) -> None:
+        for node in self.iter_nodes():
+            if node.level > 0:
+                f.write(str(node.cf) + "\n")
 
     def get_cf(self) -> List[np.ndarray]:
         cur = []
-        if self.level > 0:
-            cur.append(np.insert(self.cf.center().p, 0, self.cf.size))
-        for node in self.point_to_biconode:
-            cur = cur + node.get_cf()
+        for node in self.iter_nodes():
+            if node.level > 0:
+                size = node.storage.sizes[node.index]
+                sum = node.storage.sums[node.index]
+                if self.bico.full_sums:
+                    # the original coordinates follow the reduced ones
+                    sum = sum[self.bico.tree_dimension:]
+                cur.append(np.concatenate(([size], sum / size)))
         return cur
@@ -0,0 +1,210 @@
+import numpy as np
+from bico.geometry.point import Point
+from bico.utils.ClusteringFeature import ClusteringFeature
+
+
+class ClusteringFeatureStorage:
+    """
+    Struct-of-arrays storage for the clustering features of one level of the BICO tree. Reference points, sums, squared
+    sums, sizes and 1-means costs are kept in preallocated numpy arrays which grow by doubling. A clustering feature is
+    identified by its row index. Released rows are reused by later insertions.
+    """
+
+    def __init__(self, dimension: int, capacity: int = 64, dtype: np.dtype = np.float64, sum_dimension: int = None):
+        """
+        :param dimension:
+            Dimension of the stored clustering features
+        :param capacity:
+            Number of preallocated rows
+        :param dtype:
+            Type of the reference points. Sums, squared sums and costs are accumulated in float64 regardless.
+        :param sum_dimension:
+            Number of columns of the sums, defaults to dimension. Columns beyond dimension are summed up along but do
+            not enter the costs, e.g. the original coordinates of points whose reference points have been reduced.
+        """
+        self.dimension = dimension
+        self.sum_dimension = dimension if sum_dimension is None else sum_dimension
+        self.count = 0
+        self.free = []
+        self.refs = np.zeros((capacity, dimension), dtype=dtype)
+        self.sums = np.zeros((capacity, self.sum_dimension))
+        self.squared = np.zeros(capacity)
+        self.sizes = np.zeros(capacity)
+        # squared norm of the reference point and 1-means cost w.r.t. the reference point of each row
+        self.ref_norms = np.zeros(capacity)
+        self.costs = np.zeros(capacity)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __grow(self):
+        capacity = max(64, 2 * len(self.sizes))
+        for name in ('refs', 'sums', 'squared', 'sizes', 'ref_norms', 'costs'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def append(self, ref: np.ndarray, sum: np.ndarray, squared: float, size: float) -> int:
+        """
+        Stores a copy of a clustering feature in a new row
+        :param ref:
+            Reference point of the clustering feature
+        :param sum:
+            Sum of all points in the clustering feature
+        :param squared:
+            Sum of self inner products for all points
+        :param size:
+            Number of points represented by this clustering feature
+        :return:
+            Row index of the clustering feature
+        """
+        index = self.allocate()
+        self.set(index, ref, sum, squared, size)
+        return index
+
+    def allocate(self) -> int:
+        """
+        Reserves a row for an empty clustering feature
+        :return:
+            Row index of the clustering feature
+        """
+        if len(self.free) > 0:
+            index = self.free.pop()
+            for array in (self.refs, self.sums, self.squared, self.sizes, self.ref_norms, self.costs):
+                array[index] = 0
+            return index
+        if self.count == len(self.sizes):
+            self.__grow()
+        index = self.count
+        self.count += 1
+        return index
+
+    def release(self, indices):
+        """
+        Marks rows as unused such that they are reused by later insertions
+        :param indices:
+            Row indices of clustering features that are no longer part of the tree
+        """
+        self.sizes[indices] = 0
+        self.free.extend(np.atleast_1d(indices).tolist())
+
+    def live(self) -> np.ndarray:
+        """
+        Returns the row indices of all stored clustering features in ascending order
+        """
+        return np.flatnonzero(self.sizes[:self.count] > 0)
+
+    def set(self, index: int, ref: np.ndarray, sum: np.ndarray, squared: float, size: float):
+        """
+        Overwrites the clustering feature stored in a row
+        """
+        self.refs[index] = ref
+        self.sums[index] = sum
+        self.squared[index] = squared
+        self.sizes[index] = size
+        ref = np.asarray(self.refs[index], dtype=np.float64)
+        self.ref_norms[index] = np.inner(ref, ref)
+        self.costs[index] = squared - 2 * np.inner(ref, self.sums[index, :self.dimension]) + \
+            size * self.ref_norms[index]
+
+    def set_rows(self, indices: np.ndarray, refs: np.ndarray, sums: np.ndarray, squared: np.ndarray,
+                 sizes: np.ndarray):
+        """
+        Overwrites the clustering features stored in several rows at once
+        """
+        self.refs[indices] = refs
+        self.sums[indices] = sums
+        self.squared[indices] = squared
+        self.sizes[indices] = sizes
+        refs = np.asarray(self.refs[indices], dtype=np.float64)
+        self.ref_norms[indices] = np.einsum('ij,ij->i', refs, refs)
+        self.costs[indices] = squared - 2 * np.einsum('ij,ij->i', refs, self.sums[indices, :self.dimension]) + \
+            sizes * self.ref_norms[indices]
+
+    def insertion_cost(self, index: int, sum: np.ndarray, squared: float, size: float) -> float:
+        """
+        Returns the increase of the 1-means cost of a row if a clustering feature is added to it
+        """
+        ref = np.asarray(self.refs[index], dtype=np.float64)
+        return squared - 2 * np.inner(ref, sum[:self.dimension]) + size * self.ref_norms[index]
+
+    def insertion_costs(self, index: int, sums: np.ndarray, squared: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+        """
+        Returns the increase of the 1-means cost of a row for each clustering feature of a batch
+        """
+        # the inner products are computed in float64 since the costs are small differences of large terms
+        ref = np.asarray(self.refs[index], dtype=np.float64)
+        return squared - 2 * sums[:, :self.dimension].dot(ref) + sizes * self.ref_norms[index]
+
+    def add(self, index: int, sum: np.ndarray, squared: float, size: float, cost: float):
+        """
+        Adds a clustering feature to a row in place
+        :param cost:
+            Increase of the 1-means cost as returned by insertion_cost
+        """
+        self.sums[index] += sum
+        self.squared[index] += squared
+        self.sizes[index] += size
+        self.costs[index] += cost
+
+    def add_batch(self, index: int, sums: np.ndarray, squared: np.ndarray, sizes: np.ndarray, costs: np.ndarray):
+        """
+        Adds several clustering features to a row in place
+        :param costs:
+            Increases of the 1-means cost as returned by insertion_costs
+        """
+        self.add(index, sums.sum(axis=0, dtype=np.float64), squared.sum(), sizes.sum(), costs.sum())
+
+    def scale(self, factor: float):
+        """
+        Multiplies the sums, squared sums and sizes of all rows by a factor. Reference points are kept and the costs
+        scale by the same factor.
+        """
+        for array in (self.sums, self.squared, self.sizes, self.costs):
+            array[:self.count] *= factor
+
+    def nbytes(self) -> int:
+        """
+        Returns the bytes allocated by the arrays including preallocated rows
+        """
+        return sum(array.nbytes for array in (self.refs, self.sums, self.squared, self.sizes, self.ref_norms,
+                                              self.costs)) + 8 * len(self.free)
+
+    def view(self, index: int) -> 'StoredClusteringFeature':
+        """
+        Returns a ClusteringFeature backed by a row of this storage
+        """
+        return StoredClusteringFeature(self, index)
+
+
+class StoredClusteringFeature(ClusteringFeature):
+    """
+    Thin ClusteringFeature view on a row of a ClusteringFeatureStorage. The reference point and the sum are views on the
+    storage arrays and become stale when the storage grows.
+    """
+
+    def __init__(self, storage: ClusteringFeatureStorage, index: int):
+        self.storage = storage
+        self.index = index
+
+    @property
+    def ref(self) -> Point:
+        return Point(self.storage.refs[self.index])
+
+    @property
+    def sum(self) -> Point:
+        return Point(self.storage.sums[self.index])
+
+    @property
+    def squared(self) -> float:
+        return self.storage.squared[self.index]
+
+    @property
+    def size(self) -> float:
+        return self.storage.sizes[self.index]
+
+    def __iadd__(self, other: ClusteringFeature) -> 'StoredClusteringFeature':
+        cost = self.storage.insertion_cost(self.index, other.sum.p, other.squared, other.size)
+        self.storage.add(self.index, other.sum.p, other.squared, other.size, cost)
+        return self
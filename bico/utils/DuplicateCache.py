@@ -0,0 +1,102 @@
+import numpy as np
+import sys
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class DuplicateCache:
+    """
+    Bounded map from the key of a point to the BICO node whose clustering feature absorbed that point last. The key is
+    the raw bytes of the point or of its cell on a grid of width quantization. The least recently used entry is evicted
+    once the capacity is exceeded. Entries refer to nodes of the current tree and have to be cleared whenever the tree
+    is rebuilt.
+    """
+
+    def __init__(self, capacity: int, quantization: float = None):
+        """
+        :param capacity:
+            Maximum number of cached keys
+        :param quantization:
+            Optional grid width, points in the same grid cell share a key. Exact bytes are compared if omitted.
+        """
+        if capacity < 1:
+            raise ValueError('Capacity must be positive, got {}'.format(capacity))
+        if quantization is not None and quantization <= 0:
+            raise ValueError('Quantization must be positive, got {}'.format(quantization))
+        self.capacity = capacity
+        self.quantization = quantization
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # rows of inserted batches which were collapsed into the clustering feature of an equal key
+        self.collapsed = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def keys(self, points: np.ndarray) -> np.ndarray:
+        """
+        Returns the keys of a batch of points as rows of a 2-D array, the points themselves or their grid cells
+        """
+        if self.quantization is None:
+            return points
+        return np.floor(points / self.quantization).astype(np.int64)
+
+    def key(self, point: np.ndarray) -> bytes:
+        """
+        Returns the key of a single point given as 1-D numpy array
+        """
+        return self.keys(point).tobytes()
+
+    def get(self, key: bytes) -> Optional[Any]:
+        """
+        Returns the node cached for a key and marks it as recently used, None if the key is not cached
+        """
+        node = self.entries.get(key)
+        if node is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return node
+
+    def put(self, key: bytes, node: Any):
+        """
+        Caches the node for a key and evicts the least recently used key if the capacity is exceeded
+        """
+        self.entries[key] = node
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all entries, e.g. after the nodes of the tree have been replaced
+        """
+        if len(self.entries) > 0:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def nbytes(self) -> int:
+        """
+        Returns an estimate of the bytes allocated by the cached keys and the ordered dict, about 100 bytes per entry
+        besides the key. All keys are assumed to be as long as the oldest one.
+        """
+        if len(self.entries) == 0:
+            return sys.getsizeof(self.entries)
+        return sys.getsizeof(self.entries) + len(self.entries) * (sys.getsizeof(next(iter(self.entries))) + 100)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'quantization': self.quantization,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'collapsed': self.collapsed,
+        }
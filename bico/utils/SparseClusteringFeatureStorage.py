@@ -0,0 +1,247 @@
+import numpy as np
+from bico.utils.ClusteringFeatureStorage import StoredClusteringFeature
+from scipy.sparse import csr_matrix, issparse, vstack
+
+
+def as_row(point, dtype: np.dtype) -> csr_matrix:
+    """
+    Returns a copy of a point given as CSR row, 1-D numpy array or Point as 1 x dimension CSR matrix
+    """
+    return csr_matrix(getattr(point, 'p', point), dtype=dtype, copy=True).reshape(1, -1)
+
+
+def squared_norms(points: csr_matrix) -> np.ndarray:
+    """
+    Returns the squared euclidean norm of every row of a CSR matrix, accumulated in float64
+    """
+    points = csr_matrix(points)
+    norms = np.zeros(points.shape[0])
+    nonempty = np.diff(points.indptr) > 0
+    if nonempty.any():
+        norms[nonempty] = np.add.reduceat(np.square(points.data, dtype=np.float64), points.indptr[:-1][nonempty])
+    return norms
+
+
+class SparseRows:
+    """
+    Rows of a SparseClusteringFeatureStorage. Each row is a 1 x dimension CSR matrix or, once it has become dense, a
+    1-D float64 numpy array. Indexing with an integer returns the row as 1-D numpy array like a row of the dense
+    storage, indexing with a sequence of integers returns the rows stacked as CSR matrix.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.rows = []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if np.ndim(index) == 0:
+            row = self.rows[index]
+            return row.toarray()[0] if issparse(row) else row
+        rows = [self.rows[i] for i in np.asarray(index).tolist()]
+        if len(rows) == 0:
+            return csr_matrix((0, self.dimension))
+        return vstack([row if issparse(row) else csr_matrix(row) for row in rows], format='csr')
+
+
+class SparseClusteringFeatureStorage:
+    """
+    Storage for the clustering features of one level of the BICO tree with scipy.sparse reference points and sums, the
+    counterpart of ClusteringFeatureStorage for high-dimensional sparse input. Reference points stay sparse. A sum is
+    kept sparse until its number of nonzero entries exceeds densify_ratio * dimension and is converted to a dense
+    array afterwards, since adding to a dense row is cheaper than merging sparse rows with many nonzero entries.
+    Squared sums, sizes and costs are numpy arrays as in the dense storage.
+    """
+
+    def __init__(self, dimension: int, capacity: int = 64, dtype: np.dtype = np.float64, densify_ratio: float = 0.1):
+        """
+        :param dimension:
+            Dimension of the stored clustering features
+        :param capacity:
+            Number of preallocated rows of the numpy arrays
+        :param dtype:
+            Type of the reference points. Sums, squared sums and costs are accumulated in float64 regardless.
+        :param densify_ratio:
+            Fraction of nonzero entries above which a sum is stored as dense array
+        """
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.densify_ratio = densify_ratio
+        self.count = 0
+        self.free = []
+        self.refs = SparseRows(dimension)
+        self.sums = SparseRows(dimension)
+        self.squared = np.zeros(capacity)
+        self.sizes = np.zeros(capacity)
+        self.ref_norms = np.zeros(capacity)
+        self.costs = np.zeros(capacity)
+        # rows of empty clustering features share one empty matrix, rows are replaced rather than modified in place
+        self.empty_ref = csr_matrix((1, dimension), dtype=self.dtype)
+        self.empty_sum = csr_matrix((1, dimension))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __grow(self):
+        capacity = max(64, 2 * len(self.sizes))
+        for name in ('squared', 'sizes', 'ref_norms', 'costs'):
+            old = getattr(self, name)
+            new = np.zeros(capacity)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def __inner(self, ref: csr_matrix, sum) -> float:
+        # computed on the raw arrays of the canonical rows, which avoids the overhead of scipy.sparse operations
+        if issparse(sum):
+            _, i, j = np.intersect1d(ref.indices, sum.indices, assume_unique=True, return_indices=True)
+            return float(np.dot(ref.data[i].astype(np.float64), sum.data[j]))
+        return float(np.dot(ref.data.astype(np.float64), sum[ref.indices]))
+
+    def __store_sum(self, index: int, sum):
+        if issparse(sum) and sum.nnz > self.densify_ratio * self.dimension:
+            sum = sum.toarray()[0]
+        self.sums.rows[index] = sum
+
+    def append(self, ref, sum, squared: float, size: float) -> int:
+        """
+        Stores a copy of a clustering feature in a new row
+        :return:
+            Row index of the clustering feature
+        """
+        index = self.allocate()
+        self.set(index, ref, sum, squared, size)
+        return index
+
+    def allocate(self) -> int:
+        """
+        Reserves a row for an empty clustering feature
+        :return:
+            Row index of the clustering feature
+        """
+        if len(self.free) > 0:
+            index = self.free.pop()
+        else:
+            if self.count == len(self.sizes):
+                self.__grow()
+            index = self.count
+            self.count += 1
+            self.refs.rows.append(None)
+            self.sums.rows.append(None)
+        self.refs.rows[index] = self.empty_ref
+        self.sums.rows[index] = self.empty_sum
+        for array in (self.squared, self.sizes, self.ref_norms, self.costs):
+            array[index] = 0
+        return index
+
+    def release(self, indices):
+        """
+        Marks rows as unused such that they are reused by later insertions. Their reference points and sums are freed.
+        """
+        indices = np.atleast_1d(indices).tolist()
+        self.sizes[indices] = 0
+        for index in indices:
+            self.refs.rows[index] = self.empty_ref
+            self.sums.rows[index] = self.empty_sum
+        self.free.extend(indices)
+
+    def live(self) -> np.ndarray:
+        """
+        Returns the row indices of all stored clustering features in ascending order
+        """
+        return np.flatnonzero(self.sizes[:self.count] > 0)
+
+    def set(self, index: int, ref, sum, squared: float, size: float):
+        """
+        Overwrites the clustering feature stored in a row
+        """
+        ref = as_row(ref, self.dtype)
+        sum = as_row(sum, np.float64)
+        self.refs.rows[index] = ref
+        self.__store_sum(index, sum)
+        self.squared[index] = squared
+        self.sizes[index] = size
+        self.ref_norms[index] = squared_norms(ref)[0]
+        self.costs[index] = squared - 2 * self.__inner(ref, sum) + size * self.ref_norms[index]
+
+    def set_rows(self, indices: np.ndarray, refs: csr_matrix, sums: csr_matrix, squared: np.ndarray,
+                 sizes: np.ndarray):
+        """
+        Overwrites the clustering features stored in several rows at once
+        """
+        refs, sums = csr_matrix(refs), csr_matrix(sums)
+        for i, index in enumerate(np.asarray(indices).tolist()):
+            self.set(index, refs[i], sums[i], squared[i], sizes[i])
+
+    def insertion_cost(self, index: int, sum, squared: float, size: float) -> float:
+        """
+        Returns the increase of the 1-means cost of a row if a clustering feature is added to it
+        """
+        return squared - 2 * self.__inner(self.refs.rows[index], csr_matrix(sum)) + size * self.ref_norms[index]
+
+    def insertion_costs(self, index: int, sums: csr_matrix, squared: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+        """
+        Returns the increase of the 1-means cost of a row for each clustering feature of a batch
+        """
+        ref = self.refs.rows[index].astype(np.float64)
+        return squared - 2 * np.ravel(csr_matrix(sums).dot(ref.T).toarray()) + sizes * self.ref_norms[index]
+
+    def add(self, index: int, sum, squared: float, size: float, cost: float):
+        """
+        Adds a clustering feature to a row in place
+        :param cost:
+            Increase of the 1-means cost as returned by insertion_cost
+        """
+        sum = csr_matrix(sum)
+        row = self.sums.rows[index]
+        if issparse(row):
+            self.__store_sum(index, row + sum)
+        else:
+            # the column indices of a canonical CSR row are unique
+            row[sum.indices] += sum.data
+        self.squared[index] += squared
+        self.sizes[index] += size
+        self.costs[index] += cost
+
+    def add_batch(self, index: int, sums: csr_matrix, squared: np.ndarray, sizes: np.ndarray, costs: np.ndarray):
+        """
+        Adds several clustering features to a row in place
+        :param costs:
+            Increases of the 1-means cost as returned by insertion_costs
+        """
+        # the column sums as product with a row of ones keep the result sparse
+        total = csr_matrix(np.ones((1, sums.shape[0]))).dot(csr_matrix(sums))
+        total.sum_duplicates()
+        self.add(index, total, squared.sum(), sizes.sum(), costs.sum())
+
+    def scale(self, factor: float):
+        """
+        Multiplies the sums, squared sums and sizes of all rows by a factor. Reference points are kept and the costs
+        scale by the same factor.
+        """
+        for index in range(self.count):
+            row = self.sums.rows[index]
+            if row is not self.empty_sum:
+                self.sums.rows[index] = row * factor
+        for array in (self.squared, self.sizes, self.costs):
+            array[:self.count] *= factor
+
+    def nbytes(self) -> int:
+        """
+        Returns the bytes allocated by the arrays and by the reference points and sums of all rows, without the overhead
+        of the python objects of the rows
+        """
+        size = sum(array.nbytes for array in (self.squared, self.sizes, self.ref_norms, self.costs)) + 8 * len(self.free)
+        for row in self.refs.rows + self.sums.rows:
+            if issparse(row):
+                size += row.data.nbytes + row.indices.nbytes + row.indptr.nbytes
+            elif row is not None:
+                size += row.nbytes
+        return size
+
+    def view(self, index: int) -> StoredClusteringFeature:
+        """
+        Returns a ClusteringFeature backed by a row of this storage
+        """
+        return StoredClusteringFeature(self, index)
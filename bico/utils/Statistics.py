@@ -0,0 +1,21 @@
+import attr
+
+
+@attr.s
+class LevelStatistics:
+    """
+    Counters for the nodes of one level of the BICO tree, only collected if statistics are activated
+    """
+    # clustering features arriving at a node of this level
+    inserts = attr.ib(type=int, default=0)
+    # clustering features absorbed by the clustering feature of a node of this level
+    absorptions = attr.ib(type=int, default=0)
+    # new children opened by nodes of this level
+    opened = attr.ib(type=int, default=0)
+    # nearest neighbor queries among the children of nodes of this level
+    lookups = attr.ib(type=int, default=0)
+    candidates_scanned = attr.ib(type=int, default=0)
+    distance_evaluations = attr.ib(type=int, default=0)
+    lookup_time_ns = attr.ib(type=int, default=0)
+    # nearest neighbor structures which switched from a brute-force scan to their index
+    migrations = attr.ib(type=int, default=0)
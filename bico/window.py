@@ -0,0 +1,151 @@
+import attr
+import logging
+import numpy as np
+import time
+from bico.core import BICO
+from collections import deque
+from math import ceil
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s
+class WindowBucket:
+    bico = attr.ib(type=BICO)
+    # number of points and timestamps of the first and the last point in this bucket
+    count = attr.ib(type=int, default=0)
+    first = attr.ib(type=float, default=None)
+    last = attr.ib(type=float, default=None)
+
+
+class SlidingWindowBICO:
+    """
+    Coreset of the most recent points of an unbounded stream. The window is split into a fixed number of buckets, each
+    summarized by its own BICO instance. New points go to the newest bucket and the oldest bucket is dropped as soon
+    as the newer buckets cover the window. The bucket coresets are merged on query. Memory and insertion time are
+    bounded by number_buckets instances of coreset_size clustering features.
+    """
+
+    def __init__(self, dimension: int, number_projections: int, coreset_size: int, window_size: int = None,
+                 window_seconds: float = None, number_buckets: int = 8, **kwargs):
+        """
+        :param dimension:
+            Dimension of input points
+        :param number_projections:
+            Number of projections for faster nearest neighbor search
+        :param coreset_size:
+            Maximum number of points of each bucket and of the merged coreset
+        :param window_size:
+            Number of most recent points covered by the window
+        :param window_seconds:
+            Length of the window in seconds, used instead of window_size
+        :param number_buckets:
+            Number of buckets per window. More buckets follow the window more closely, i.e. fewer expired points are
+            still contained, at the cost of more memory and more expensive queries.
+        :param kwargs:
+            Further arguments of the BICO constructor
+        """
+        if (window_size is None) == (window_seconds is None):
+            raise ValueError('Specify either window_size or window_seconds')
+        if number_buckets < 1:
+            raise ValueError('Need at least one bucket, got {}'.format(number_buckets))
+        self.dimension = dimension
+        self.number_projections = number_projections
+        self.coreset_size = coreset_size
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.kwargs = kwargs
+        if window_size is not None:
+            self.bucket_size = int(ceil(window_size / number_buckets))
+        else:
+            self.bucket_seconds = window_seconds / number_buckets
+        self.buckets = deque()
+
+    def __new_bucket(self) -> WindowBucket:
+        bucket = WindowBucket(BICO(self.dimension, self.number_projections, self.coreset_size, **self.kwargs))
+        self.buckets.append(bucket)
+        return bucket
+
+    def insert_batch(self, points: np.ndarray, timestamps: np.ndarray = None):
+        """
+        Insert a batch of points into the window and drop buckets which left it.
+        :param points:
+            2-D numpy array with one point per row
+        :param timestamps:
+            Non-decreasing timestamps in seconds of the points, only used for time windows. Defaults to the current
+            time for all points.
+        :return:
+            None
+        """
+        points = np.array(points, ndmin=2, copy=None)
+        if len(points) == 0:
+            return
+        if self.window_size is not None:
+            self.__insert_counted(points)
+        else:
+            if timestamps is None:
+                timestamps = np.full(len(points), time.time())
+            self.__insert_timed(points, np.asarray(timestamps, dtype=float))
+        self.expire()
+
+    def __insert_counted(self, points: np.ndarray):
+        start = 0
+        while start < len(points):
+            bucket = self.buckets[-1] if len(self.buckets) > 0 else None
+            if bucket is None or bucket.count >= self.bucket_size:
+                bucket = self.__new_bucket()
+            end = min(len(points), start + self.bucket_size - bucket.count)
+            bucket.bico.insert_batch(points[start:end])
+            bucket.count += end - start
+            start = end
+
+    def __insert_timed(self, points: np.ndarray, timestamps: np.ndarray):
+        start = 0
+        while start < len(points):
+            bucket = self.buckets[-1] if len(self.buckets) > 0 else None
+            if bucket is None or timestamps[start] >= bucket.first + self.bucket_seconds:
+                bucket = self.__new_bucket()
+                bucket.first = timestamps[start]
+            end = int(np.searchsorted(timestamps, bucket.first + self.bucket_seconds, side='left'))
+            end = max(end, start + 1)
+            bucket.bico.insert_batch(points[start:end])
+            bucket.count += end - start
+            bucket.last = timestamps[end - 1]
+            start = end
+
+    def expire(self, now: float = None):
+        """
+        Drops the oldest buckets as long as the newer buckets cover the window
+        :param now:
+            Current time in seconds for time windows, defaults to the timestamp of the newest point
+        :return:
+            None
+        """
+        if self.window_size is not None:
+            covered = sum(bucket.count for bucket in self.buckets)
+            while len(self.buckets) > 1 and covered - self.buckets[0].count >= self.window_size:
+                covered -= self.buckets.popleft().count
+        elif len(self.buckets) > 0:
+            now = self.buckets[-1].last if now is None else now
+            while len(self.buckets) > 0 and self.buckets[0].last < now - self.window_seconds:
+                self.buckets.popleft()
+
+    @property
+    def num_points(self) -> int:
+        """
+        Number of points currently summarized, at least the window size once the stream is long enough
+        """
+        return sum(bucket.count for bucket in self.buckets)
+
+    def get_coreset(self) -> np.ndarray:
+        """
+        Merges the coresets of all buckets of the window
+        :return:
+            (coreset size) x (dim+1) dimensional numpy array in the format of BICO.get_coreset
+        """
+        if len(self.buckets) == 0:
+            return np.empty((0, self.dimension + 1))
+        coreset = np.vstack([bucket.bico.get_coreset() for bucket in self.buckets])
+        if len(coreset) <= self.coreset_size:
+            return coreset
+        return BICO.from_coreset(coreset, self.number_projections, self.coreset_size, **self.kwargs).get_coreset()
@@ -1,34 +1,25 @@
 import sys
 
-import csv
 import getopt
-import numpy as np
+from bico.cli import read_csv
 from bico.core import BICO
-from bico.geometry.point import Point
 from datetime import datetime
 
 
 def run_bico(n, d, size, p, file):
-    bico = BICO(d, 5, p, size)
+    bico = BICO(d, p, size)
     tstart = datetime.now()
-    no = 1
-    with open(file, 'rb') as csvfile:
-        spamreader = csv.reader(csvfile, delimiter=',')
-        for row in spamreader:
-            p = Point(np.array(map(float, row)))
-            bico.insert_point(p)
-            no += 1
-            if no % 1000 == 0:
-                print("Read geometry number " + str(no))
+    no = 0
+    for chunk in read_csv(file, 10000):
+        bico.insert_batch(chunk)
+        no += len(chunk)
+        print("Read geometry number " + str(no))
     tend = datetime.now()
     print(bico.num_cfs)
-    print()
-    tend - tstart
+    print(tend - tstart)
     for t in bico.time:
         print(t)
-    f = open('coreset.out', 'w')
-    bico.output_coreset(f)
-    f.close()
+    bico.output_coreset('coreset.npy')
 
 
 if __name__ == '__main__':
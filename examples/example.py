@@ -4,7 +4,6 @@ import multiprocessing
 import numpy as np
 import os
 from bico.core import BICO
-from bico.geometry.point import Point
 from datetime import datetime
 from sklearn.cluster import KMeans
 from sklearn.datasets import make_blobs
@@ -31,12 +30,13 @@ def run_bico_parellel(X):
 
 
 def run_bico(size, X):
-    bico = BICO(2, n_samples, projections, size, proj_method, False)
+    bico = BICO(2, number_projections=projections, coreset_size=size, projection_method=proj_method,
+                collect_stats=True)
 
-    for row in X:
-        bico.insert_point(Point(row))
+    bico.insert_batch(X)
 
     c = bico.get_coreset()
+    print("Coreset of {} points with total weight {}".format(len(c), c[:, 0].sum()))
 
     for i, time in enumerate(bico.time):
         print("Time spent on level {}: {}".format(i, time))
@@ -48,6 +48,7 @@ print(os.cpu_count())
 tstart = datetime.now()
 with concurrent.futures.ProcessPoolExecutor() as executor:
     X_chunks = np.array_split(X_varied, 4)
-    executor.map(run_bico_parellel, X_chunks)
+    # consume the results such that errors of the workers are raised
+    list(executor.map(run_bico_parellel, X_chunks))
 tend = datetime.now()
 print("Time spent: {}".format(tend - tstart))
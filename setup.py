@@ -9,5 +9,7 @@ setup(
     author='Marc Bury',
     author_email='burycram@googlemail.com',
     description='BICO is a fast streaming algorithm and reduction technique for the k-means problem.',
-    install_requires=['numpy', 'scipy', 'nearpy', 'attrs']
+    install_requires=['numpy', 'scipy', 'attrs'],
+    extras_require={'nearpy': ['nearpy']},
+    entry_points={'console_scripts': ['bico=bico.cli:main']}
 )